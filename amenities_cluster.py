@@ -1,76 +1,191 @@
+import threading
 import pandas as pd
-import geopandas as gpd
 import numpy as np
 from sklearn.cluster import DBSCAN
-from shapely.geometry import Point
 import streamlit as st
+from opening_hours import is_open_at, hour_of_week
+from spatial_index import build_grid_index, query_radius, to_projected_xy
+from vancouver_amenities import match_amenities
+from data_store import load_amenity_table, table_generation, is_current
 
-@st.cache_data(show_spinner="Clustering amenities...")
-def get_clusters():
+# DBSCAN clustering for each category:
+# - 'food & drink'
+# - 'transportation'
+# - 'entertainments & culture'
+# - 'health & emergency'
+# - 'shop & services'
+# DBSCAN parameters tuned per category
+DBSCAN_PARAMS = {
+    'food & drink': {'eps': 200, 'min_samples': 15},  # high density
+    'transportation': {'eps': 250, 'min_samples': 10},  # medium density
+    'entertainments & culture': {'eps': 300, 'min_samples': 8},  # sparse but localized
+    'health & emergency': {'eps': 300, 'min_samples': 5},  # very sparse
+    'shop & services': {'eps': 300, 'min_samples': 8}  # sparse but localized
+}
+CATEGORIES = list(DBSCAN_PARAMS)
+
+# amenities of each category with their cluster labels (including noise, -1), keyed by open_at,
+# least recently used first; kept so that amenity diffs only re-cluster the affected regions
+# (see update_clusters) and shared by all session threads (guarded by _labelled_lock)
+_labelled = {}
+_labelled_lock = threading.Lock()
+
+# labelled copies kept (about 2 MB each); other opening times are re-clustered on demand
+MAX_LABELLED = 4
+
+def dbscan_labels(coords, category):
     """
-    Load amenities data, perform DBSCAN clustering, and return clustered dataframes for each category.
-    
+    Run DBSCAN on projected coordinates with the parameters tuned for a category.
+
     Returns:
-    - clustered_dfs: A dictionary of clustered dataframes for each category.
+    - An array of cluster labels (-1 for noise).
     """
-    # load amenities data
-    amenities = pd.read_csv('data/vancouver_amenities.csv')
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # eps: radius of neighborhood in meters
+    # min_samples: minimum number of samples in a neighborhood to form a cluster
+    params = DBSCAN_PARAMS.get(category, {'eps': 300, 'min_samples': 10})
+    dbscan = DBSCAN(eps=params['eps'], min_samples=params['min_samples']).fit(coords)
+    return dbscan.labels_.astype(np.int64)
 
-    # create geometry column
-    amenities['geometry'] = amenities.apply(lambda row: Point(row['lon'], row['lat']), axis=1)
+def label_amenities(open_at=None):
+    """
+    Load amenities data and label each amenity with its DBSCAN cluster, per category.
 
-    # create a geodataframe with epsg: 4326 for Vancouver
-    amenities_gdf = gpd.GeoDataFrame(amenities, geometry='geometry', crs='EPSG:4326')
+    Arguments:
+    - open_at: Optional datetime or hour-of-week index (0 = Monday 00:00); only amenities open at that time are clustered.
+
+    Returns:
+    - A dictionary of dataframes for each category, with projected 'x'/'y' columns (EPSG:26910)
+      and a 'cluster' column (-1 for noise).
+    """
+    open_at = hour_of_week(open_at) if open_at is not None else None
+    with _labelled_lock:
+        if open_at in _labelled:
+            _labelled[open_at] = _labelled.pop(open_at)  # mark as most recently used
+            return _labelled[open_at]
+
+    # load amenities data
+    generation = table_generation()
+    amenities = load_amenity_table()
+
+    # keep only amenities open at the requested time (amenities with unknown hours are kept)
+    if open_at is not None:
+        amenities = amenities[is_open_at(amenities, open_at)]
 
     # convert to epsg 26910 for DBSCAN
-    amenities_gdf = amenities_gdf.to_crs(epsg=26910)
-
-    # DBSCAN clustering for each category:
-    # - 'food & drink'
-    # - 'transportation'
-    # - 'entertainments & culture'
-    # - 'health & emergency'
-    # - 'shop & services'
-    # DBSCAN parameters tuned per category
-    dbscan_params = {
-        'food & drink': {'eps': 200, 'min_samples': 15},  # high density
-        'transportation': {'eps': 250, 'min_samples': 10},  # medium density
-        'entertainments & culture': {'eps': 300, 'min_samples': 8},  # sparse but localized
-        'health & emergency': {'eps': 300, 'min_samples': 5},  # very sparse
-        'shop & services': {'eps': 300, 'min_samples': 8}  # sparse but localized
-    }
+    amenities = amenities.copy()
+    amenities[['x', 'y']] = to_projected_xy(amenities['lon'], amenities['lat'])
 
-    clustered_dfs = {}
-    categories = ['food & drink', 'transportation', 'entertainments & culture', 'health & emergency', 'shop & services']
-    for category in categories:
+    labelled = {}
+    for category in CATEGORIES:
         # create a subdataframe for each category
-        category_df = amenities_gdf[amenities_gdf['category'] == category].copy()
+        category_df = amenities[amenities['category'] == category].reset_index(drop=True)
+        category_df['cluster'] = dbscan_labels(category_df[['x', 'y']].to_numpy(), category)
+        labelled[category] = category_df
+
+    with _labelled_lock:
+        if not is_current(generation):
+            return labelled  # the amenities changed while clustering; update_clusters may have missed this result
+        _labelled[open_at] = labelled
+        while len(_labelled) > MAX_LABELLED:
+            del _labelled[next(iter(_labelled))]
+    return labelled
+
+def recluster_region(category_df, removed, added, category):
+    """
+    Apply removed/added amenities to a labelled category and re-run DBSCAN only around the changes.
+
+    A change can only alter the core status of points within eps of it, and so only the clusters
+    reachable within 2 * eps. Those points and their whole clusters are re-clustered (together with
+    their eps-neighbours, so core points see their full neighbourhood); all other labels are kept.
+
+    Returns:
+    - The updated category dataframe.
+    """
+    eps = DBSCAN_PARAMS.get(category, {'eps': 300})['eps']
+
+    # apply the diff
+    if not removed.empty:
+        category_df = category_df[~match_amenities(category_df, removed)]
+    added = added.assign(cluster=-1)
+    added[['x', 'y']] = to_projected_xy(added['lon'], added['lat'])
+    category_df = pd.concat([category_df, added[category_df.columns]], ignore_index=True)
+    if category_df.empty:
+        return category_df
+
+    xy = category_df[['x', 'y']].to_numpy()
+    labels = category_df['cluster'].to_numpy().copy()
+    changed_xy = np.vstack([
+        to_projected_xy(removed['lon'], removed['lat']),
+        added[['x', 'y']].to_numpy(),
+    ])
+
+    # region: points within 2 * eps of a change, plus every cluster they belong to
+    index = build_grid_index(xy, cell_size=eps)
+    _, seed, _ = query_radius(index, xy, changed_xy, 2 * eps)
+    hit = np.unique(labels[seed])
+    region = np.isin(labels, hit[hit != -1])
+    region[seed] = True
+
+    # context: the region and the eps-neighbours of its points
+    _, neighbours, _ = query_radius(index, xy, xy[region], eps)
+    context = region.copy()
+    context[neighbours] = True
+    context_idx = np.flatnonzero(context)
 
-        # get the coordinates in meters
-        coords = np.vstack(category_df.geometry.apply(lambda geom: (geom.x, geom.y)))
+    # re-cluster the context, relabelling only the region with cluster ids that are not in use
+    new_labels = dbscan_labels(xy[context_idx], category)
+    new_labels = np.where(new_labels == -1, -1, new_labels + labels.max() + 1)
+    in_region = region[context_idx]
+    labels[context_idx[in_region]] = new_labels[in_region]
+
+    category_df['cluster'] = labels
+    return category_df
+
+def update_clusters(removed, added):
+    """
+    Update the labelled amenities for removed and added amenities, re-clustering only the
+    affected categories and regions, and invalidate the cached get_clusters results.
+
+    Arguments:
+    - removed: DataFrame of removed amenities (stored format: lat, lon, amenity, name, category, hours columns).
+    - added: DataFrame of added amenities (stored format).
+    """
+    with _labelled_lock:
+        for open_at, labelled in _labelled.items():
+            open_removed, open_added = removed, added
+            if open_at is not None:
+                open_removed = removed[is_open_at(removed, open_at)]
+                open_added = added[is_open_at(added, open_at)]
 
-        # DBSCAN clustering
-        # eps: radius of neighborhood in meters
-        # min_samples: minimum number of samples in a neighborhood to form a cluster
-        params = dbscan_params.get(category, {'eps': 300, 'min_samples': 10})
-        dbscan = DBSCAN(eps=params['eps'], min_samples=params['min_samples']).fit(coords)
-        category_df['cluster'] = dbscan.labels_
+            for category in CATEGORIES:
+                category_removed = open_removed[open_removed['category'] == category]
+                category_added = open_added[open_added['category'] == category]
+                if category_removed.empty and category_added.empty:
+                    continue  # category not affected
+                labelled[category] = recluster_region(labelled[category], category_removed, category_added, category)
 
-        # filter out noise (-1)
+    get_clusters.clear()
+
+# cache_resource shares one result between all sessions and reruns instead of handing each a copy;
+# the returned dataframes are read-only, callers must not modify them
+@st.cache_resource(show_spinner="Clustering amenities...", max_entries=MAX_LABELLED)
+def get_clusters(open_at=None):
+    """
+    Load amenities data, perform DBSCAN clustering, and return clustered dataframes for each category.
+
+    Arguments:
+    - open_at: Optional datetime or hour-of-week index (0 = Monday 00:00); only amenities open at that time are clustered.
+
+    Returns:
+    - clustered_dfs: A dictionary of clustered dataframes for each category.
+    """
+    clustered_dfs = {}
+    for category, category_df in label_amenities(open_at).items():
+        # filter out noise (-1) and drop the projected coordinates
         category_df = category_df[category_df['cluster'] != -1]
-        
-        # append to the list of clustered dataframes
-        clustered_dfs[category] = category_df
-
-    # convert back to epsg 4326
-    for category in clustered_dfs:
-        clustered_dfs[category] = clustered_dfs[category].to_crs(epsg=4326)
-        clustered_dfs[category].reset_index(drop=True, inplace=True)
-        clustered_dfs[category]['geometry'] = clustered_dfs[category].geometry.apply(lambda geom: Point(geom.x, geom.y))
-        clustered_dfs[category]['lat'] = clustered_dfs[category].geometry.apply(lambda geom: geom.y)
-        clustered_dfs[category]['lon'] = clustered_dfs[category].geometry.apply(lambda geom: geom.x)
-    # drop geometry column
-    for category in clustered_dfs:
-        clustered_dfs[category].drop(columns=['geometry'], inplace=True)
-
-    return clustered_dfs
\ No newline at end of file
+        clustered_dfs[category] = category_df.drop(columns=['x', 'y']).reset_index(drop=True)
+
+    return clustered_dfs
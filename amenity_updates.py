@@ -0,0 +1,61 @@
+import pandas as pd
+from opening_hours import HOURS_COLUMNS
+from vancouver_amenities import prepare_amenities, match_amenities
+from hotel_ranking import update_counts, update_incidence
+from amenities_cluster import update_clusters
+from density_grid import update_density_grids
+from ranking_store import clear_rankings
+from data_store import clear_tables
+
+def apply_amenity_diff(added=None, removed=None, modified=None, path='data/vancouver_amenities.csv'):
+    """
+    Apply a diff of OSM amenities without re-running the full ingestion.
+
+    The stored amenities csv is updated, then the cached hotel x category counts are adjusted for
+    the hotels around the changed amenities, the hotel x amenity incidence matrices gain/lose the
+    changed columns, only the affected categories/regions are re-clustered
+    and only the density grid cells around the changes are recomputed.
+    The caches live in the running process, so call this from the process that serves the rankings.
+
+    Arguments:
+    - added: DataFrame of new amenities in the raw OSM format (lat, lon, timestamp, amenity, name, tags).
+    - removed: DataFrame identifying the deleted amenities by lat, lon, amenity and name.
+    - modified: DataFrame of amenities whose other fields (e.g. tags, opening hours) changed, in the raw
+      OSM format. A moved or renamed amenity is a removal plus an addition.
+
+    Returns:
+    - A dictionary with the number of 'added', 'removed' and 'modified' amenities that were applied.
+    """
+    amenities = pd.read_csv(path)
+    empty = pd.DataFrame(columns=['lat', 'lon', 'timestamp', 'amenity', 'name', 'tags']).astype({'lat': float, 'lon': float})
+    added = prepare_amenities(added if added is not None else empty)
+    modified = prepare_amenities(modified if modified is not None else empty)
+    removed = removed if removed is not None else empty
+
+    # the stored rows replaced by the diff (deleted or modified)
+    replaced = match_amenities(amenities, pd.concat([removed, modified], ignore_index=True))
+    removed_rows = amenities[replaced]
+    added_rows = pd.concat([added, modified[match_amenities(modified, removed_rows)]], ignore_index=True)
+
+    # the applied changes, counted before anything is written
+    applied = {
+        'added': len(added),
+        'removed': int(match_amenities(removed_rows, removed).sum()),
+        'modified': len(added_rows) - len(added),
+    }
+
+    # update the stored amenity data (caches filled from the old data from now on are not kept)
+    clear_tables()
+    amenities = pd.concat([amenities[~replaced], added_rows[amenities.columns]], ignore_index=True)
+    amenities[HOURS_COLUMNS] = amenities[HOURS_COLUMNS].astype('Int64')
+    amenities.to_csv(path, index=False)
+
+    # update the cached counts and clusters around the changes
+    update_counts(removed_rows, added_rows)
+    update_incidence(removed_rows, added_rows)
+    update_clusters(removed_rows, added_rows)
+    update_density_grids(removed_rows, added_rows)
+    clear_rankings()  # recomputed on demand from the updated counts
+    clear_tables()  # reloaded from the updated csv on demand; caches can be filled again
+
+    return applied
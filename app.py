@@ -1,25 +1,31 @@
 import streamlit as st
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from streamlit_folium import st_folium
 import folium
 import pandas as pd
 import geopandas as gpd
-from shapely import MultiPoint, wkt
-from generate_tour import generate_tsp_route, generate_nn_route
-from hotel_ranking import score_hotels, get_score_color
+from shapely import MultiPoint
+from concurrent.futures import wait, FIRST_COMPLETED
+from tour_jobs import submit_tour, cancel_tour
+from hotel_ranking import get_score_color, nearby_amenities
+from ranking_store import ranking_key, ranked_hotels
+from data_store import load_hotel_table, to_geodataframe
+from memory_report import footprint_report
 from shapely.geometry import Point
 from calculate_distance import calculate_distance
 from amenities_cluster import get_clusters
+from density_grid import score_location
 
 # === Set page config ===
 st.set_page_config(page_title="Hotelytics", layout="wide")
 
 # === Load Vancouver Hotels Data ===
-@st.cache_data
+# cache_resource shares one hotel table between all sessions (it is only read, never modified);
+# rankings are stored as score arrays aligned to its rows (see ranking_store)
+@st.cache_resource
 def load_hotels():
-    hotels = pd.read_csv("data/vancouver_hotels.csv")
-    hotels['geometry'] = hotels['geometry'].apply(wkt.loads)
-    hotels = gpd.GeoDataFrame(hotels, geometry='geometry', crs="EPSG:4326")  # convert to crs: EPSG:4326 for folium
-    return hotels
+    return to_geodataframe(load_hotel_table())  # crs: EPSG:4326 for folium
 
 hotels = load_hotels()
 
@@ -39,7 +45,7 @@ attractions = load_attractions()
 st.title("Hotelytics: Vancouver Hotel and Tour Generator")
 st.write("Hotelytics helps visitors find the most suitable hotel in Vancouver based on surrounding amenities and also generates a personalized walking tour from the selected hotel to nearby attractions using real street network data.")
 
-if st.session_state.get("ranked_hotels") is None:
+if st.session_state.get("ranking_key") is None:
     st.subheader("Map of Hotels and Attractions")
     st.write(f"There are {len(hotels)} hotels in Vancouver, and the following map shows both hotels and curated attractions around the city.")
 
@@ -55,9 +61,13 @@ if st.sidebar.checkbox("Show attraction data"):
     st.subheader("Attraction Data")
     st.dataframe(attractions[['name', 'street name', 'short description']], use_container_width=True)
 
+if st.sidebar.checkbox("Show memory footprint", help="Memory held by the loaded datasets and the caches shared by all sessions."):
+    st.subheader("Memory Footprint")
+    st.dataframe(footprint_report(), use_container_width=True, hide_index=True)
+
 # === Create the Ranking sidebar ===
-if "ranked_hotels" not in st.session_state:
-    st.session_state['ranked_hotels'] = None
+if "ranking_key" not in st.session_state:
+    st.session_state['ranking_key'] = None
 
 # === Sidebar Header ===
 st.sidebar.header("Rank Hotels")
@@ -72,11 +82,19 @@ ranking = {
     "shop & services": st.sidebar.slider("Shop & Services", 0, 5, 3, help="ATMs, post offices, markets"),
 }
 
+# === Opening Hours Filter ===
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+open_at = None
+if st.sidebar.checkbox("Only count places open at a given time", help="Amenities without opening hours in OpenStreetMap are always counted."):
+    now = datetime.now(ZoneInfo("America/Vancouver"))  # local time for the guests, whatever the server timezone
+    open_day = st.sidebar.selectbox("Day", WEEKDAY_NAMES, index=now.weekday())
+    open_hour = st.sidebar.slider("Hour", 0, 23, now.hour, format="%d:00")
+    open_at = WEEKDAY_NAMES.index(open_day) * 24 + open_hour  # hour of the week
+
 # === Sidebar Button ===
 if st.sidebar.button("Rank Hotels"):
-    ranked_hotels = score_hotels(hotels, ranking)
-    ranked_hotels = ranked_hotels.sort_values(by='total_score', ascending=False, ignore_index=True)
-    st.session_state['ranked_hotels'] = ranked_hotels  # save ranked hotels to session state
+    # the scores are kept in the process-wide ranking store; the session only keeps the key
+    st.session_state['ranking_key'] = ranking_key(ranking, open_at=open_at)
 
 # === Sidebar Select Hotel & Generate Tour ===
 st.sidebar.header("Generate Walking Tour")
@@ -84,17 +102,29 @@ selected_hotel = st.sidebar.selectbox(
     "Choose a hotel to generate a walking tour:",
     options=hotels['name'].tolist()
 )
+
+# === Cancel the running tour when another hotel is picked ===
+if st.session_state.get("tour_generated") and st.session_state['selected_hotel']['name'] != selected_hotel:
+    cancel_tour(st.session_state['tour_job'])
+    st.session_state['tour_generated'] = False
+
 if st.sidebar.button("Generate Tour"):
     hotel_row = hotels[hotels['name'] == selected_hotel].iloc[0]
     sorted_attractions = calculate_distance(hotel_row, attractions)
 
+    # compute the tours in the background; they are displayed as soon as each one is ready
+    if st.session_state.get("tour_job") is not None:
+        cancel_tour(st.session_state['tour_job'])
+    st.session_state['tour_job'] = submit_tour(hotel_row, sorted_attractions)
+
     st.session_state['sorted_attractions'] = sorted_attractions
     st.session_state['tour_generated'] = True
     st.session_state['selected_hotel'] = hotel_row
 
 # === Always display ranked table if exists ===
 best_hotel = None
-if st.session_state['ranked_hotels'] is not None:
+ranked = ranked_hotels(hotels, st.session_state['ranking_key']) if st.session_state['ranking_key'] is not None else None
+if ranked is not None:
     st.success("Hotels successfully ranked based on your preferences!")
     st.subheader("Top 10 Hotels")
     st.write("The following table shows the top 10 hotels based on your preferences. Click on a hotel to see its score breakdown.")
@@ -110,6 +140,7 @@ if st.session_state['ranked_hotels'] is not None:
             ```
             Total Score = (count_food × weight_food) + (count_transport × weight_transport) + ...
             ```
+        - If the opening hours filter is on, only amenities **open at the chosen day and hour** are counted (places without opening hours in OpenStreetMap are always counted).
         - After scoring, we **normalize** all scores to a 0–100 scale for easy comparison.
 
         **Example**:
@@ -125,13 +156,21 @@ if st.session_state['ranked_hotels'] is not None:
 
 
     # top 10 hotels to show
-    top_10_df = st.session_state['ranked_hotels'][['name', 'total_score']].head(10).copy()
+    top_10_df = ranked[['name', 'total_score']].head(10).copy()
     selected_row = st.data_editor(top_10_df, use_container_width=True, hide_index=True, num_rows="fixed")
 
     # get the selected hotel (simulate click by filtering row with max score)
     if isinstance(selected_row, pd.DataFrame) and not selected_row.empty:
         best_hotel_name = selected_row.iloc[0]['name']
-        best_hotel = st.session_state['ranked_hotels'][st.session_state['ranked_hotels']['name'] == best_hotel_name].iloc[0]
+        best_hotel = ranked[ranked['name'] == best_hotel_name].iloc[0]
+
+        # === Amenities near the selected hotel ===
+        with st.expander(f"Amenities near {best_hotel_name}"):
+            nearby_category = st.selectbox("Category", list(ranking.keys()), key="nearby_category")
+            hotel_idx = hotels.index[hotels['name'] == best_hotel_name][0]  # hotels has a RangeIndex
+            nearby = nearby_amenities(hotels, hotel_idx, category=nearby_category, open_at=open_at)
+            st.write(f"{len(nearby)} {nearby_category} places within 350 m.")
+            st.dataframe(nearby[['name', 'amenity', 'distance_m']].rename(columns={'distance_m': 'distance (m)'}), hide_index=True, use_container_width=True)
 
 # === Set map center based on selected hotel or default ===
 if best_hotel is not None:
@@ -147,7 +186,7 @@ hotel_layer = folium.FeatureGroup(name="Hotels", show=True)
 attraction_layer = folium.FeatureGroup(name="Tourist Attractions", show=True)
 
 # === Ensure map_hotels is a GeoDataFrame with correct CRS ===
-map_hotels = st.session_state['ranked_hotels'] if st.session_state['ranked_hotels'] is not None else hotels
+map_hotels = ranked if ranked is not None else hotels
 if 'geometry' in map_hotels.columns:
     map_hotels = gpd.GeoDataFrame(map_hotels, geometry='geometry', crs="EPSG:4326")
 
@@ -183,7 +222,7 @@ for _, row in attractions.iterrows():
     ).add_to(attraction_layer)
   
 # === Add Clusters to Map ===
-clusters = get_clusters()
+clusters = get_clusters(open_at)
 
 CATEGORY_COLORS = {
     'food & drink': 'red',
@@ -231,40 +270,23 @@ folium.LayerControl(collapsed=False).add_to(ranking_map)
 # === Render map and capture click ===
 map_data = st_folium(ranking_map, width="100%")
 
-# === Tour generation ===
-if st.session_state.get("tour_generated"):
-    st.subheader("Walking Tour Path Result")
-    st.success(f"Generated a walking tour path from {selected_hotel} to nearby attractions")
+# === Score the clicked location ===
+if map_data and map_data.get("last_clicked"):
+    clicked_lat, clicked_lon = map_data["last_clicked"]["lat"], map_data["last_clicked"]["lng"]
+    # constant-time lookup in the precomputed amenity density grids, scaled so the best hotel scores 100
+    location = score_location(clicked_lon, clicked_lat, ranking, open_at=open_at, reference=(hotels.geometry.x, hotels.geometry.y)).iloc[0]
 
-    selected_hotel_row = st.session_state.get("selected_hotel")
-    sorted_attractions = st.session_state.get("sorted_attractions")
+    st.subheader("Score at Clicked Location")
+    st.write(f"A stay at ({clicked_lat:.5f}, {clicked_lon:.5f}) would score **{location['total_score']:.1f}** with your preferences, where the best-matching hotel scores 100.")
+    st.dataframe(pd.DataFrame({
+        "Category": [category.title() for category in ranking],
+        "Amenities within 350m": [location[f'count_{category.replace(" ", "_")}'] for category in ranking],
+        "Weighted Score": [location[f'score_{category.replace(" ", "_")}'] for category in ranking],
+    }), use_container_width=True, hide_index=True)
 
-    if selected_hotel_row is not None and sorted_attractions is not None:
-        try:
-            # === Traveling Salesman Problem (TSP) ===
-            # get the routes coords
-            tsp_route_coords, tsp_ordered_stop_names, tsp_segment_distances = generate_tsp_route(selected_hotel_row, sorted_attractions)
-            
-            # Create a new map centered on the selected hotel for the TSP algorithm
-            tsp_tour_map = folium.Map(location=[selected_hotel_row.geometry.y, selected_hotel_row.geometry.x], zoom_start=14)
-
-            # build an itinerary for the tour
-            # note: If there are N stops, there are N-1 segments.
-            itinerary_data = []
-            for i in range(len(tsp_segment_distances)):
-                from_stop = tsp_ordered_stop_names[i]
-                to_stop   = tsp_ordered_stop_names[i+1]
-                # Convert meters to kilometers
-                distance_km = tsp_segment_distances[i] / 1000
-                itinerary_data.append({
-                    "From": from_stop,
-                    "To": to_stop,
-                    "Distance (km)": f"{distance_km:.2f}"
-                })
-            itinerary_df = pd.DataFrame(itinerary_data)
-            st.subheader("Traveling Salesman Problem Itinerary (Total Distance: {:.2f} km)".format(sum(tsp_segment_distances) / 1000))
-            with st.expander("How does Traveling Salesman Problem work?"):
-                st.markdown("""
+# === Tour generation ===
+TOUR_DESCRIPTIONS = {
+    'tsp': ("Traveling Salesman Problem", """
                 - This algorithm finds the **shortest possible route** that visits all attractions **once** and returns to the starting point (hotel).
                 - It considers **real walking paths** using OpenStreetMap data.
                 - It guarantees a near-optimal route but may take slightly longer to compute.
@@ -274,73 +296,8 @@ if st.session_state.get("tour_generated"):
                 2. Build a distance graph between all points.
                 3. Use a TSP solver to find the shortest possible path.
                 4. Calculate the real walking route between each stop.
-                """)
-
-            st.dataframe(itinerary_df, use_container_width=True, hide_index=True)
-
-            # Add a marker for the starting hotel          
-            unit = int(selected_hotel_row['unit']) if pd.notna(selected_hotel_row['unit']) else ""
-            postcode = selected_hotel_row['postcode'] if pd.notna(selected_hotel_row['postcode']) else ""
-            popup_html = (
-                f"<strong>{selected_hotel_row['name']}</strong><br>"
-                f"{str(selected_hotel_row['housenumber'])} {selected_hotel_row['street']}{(' ' + str(unit)) if unit else ''}, "
-                f"{selected_hotel_row['city']}, {selected_hotel_row['province']} {postcode}<br>"
-            )
-            folium.Marker(
-                location=[selected_hotel_row.geometry.y, selected_hotel_row.geometry.x],
-                popup=folium.Popup(popup_html, max_width=300),
-                icon=folium.Icon(color="black", icon="bed", prefix="fa")
-            ).add_to(tsp_tour_map)
-
-            # Add markers for the attractions
-            for attraction in sorted_attractions.itertuples():
-                # Build an HTML popup containing the attraction's info:
-                popup_html = (
-                    f"<strong>{attraction.name}</strong><br>"
-                    f"{attraction._4}<br>"
-                    f"{attraction._5}<br>"
-                    f"<em>Distance: {attraction.distance_km:.2f} km</em>"
-                )
-                folium.Marker(
-                    location=[attraction.lat, attraction.lon],
-                    popup=folium.Popup(popup_html, max_width=300),
-                    icon=folium.Icon(color="darkblue", icon="star", prefix="fa")
-                ).add_to(tsp_tour_map)
-
-            # Add the walking tour path
-            folium.PolyLine(
-                locations=tsp_route_coords,
-                color="blue",
-                weight=5,
-                opacity=0.7
-            ).add_to(tsp_tour_map)
-
-            # Display the tour map
-            st_folium(tsp_tour_map, width="100%")
-
-
-            # === Nearest Neighbor (Greedy) ===
-            greedy_route_coords, greedy_ordered_stop_names, greedy_segment_distances = generate_nn_route(selected_hotel_row, sorted_attractions)
-
-            greedy_tour_map = folium.Map(location=[selected_hotel_row.geometry.y, selected_hotel_row.geometry.x], zoom_start=14)
-
-            # build an itinerary for the tour
-            # note: If there are N stops, there are N-1 segments.
-            greedy_itinerary_data = []
-            for i in range(len(greedy_segment_distances)):
-                from_stop = greedy_ordered_stop_names[i]
-                to_stop   = greedy_ordered_stop_names[i+1]
-                # Convert meters to kilometers
-                distance_km = greedy_segment_distances[i] / 1000
-                greedy_itinerary_data.append({
-                    "From": from_stop,
-                    "To": to_stop,
-                    "Distance (km)": f"{distance_km:.2f}"
-                })
-            greedy_itinerary_df = pd.DataFrame(greedy_itinerary_data)
-            st.subheader("Nearest Neighbour (Greedy) Itinerary (Total Distance: {:.2f} km)".format(sum(greedy_segment_distances) / 1000))
-            with st.expander("How does Nearest Neighbour (Greedy) work?"):
-                st.markdown("""
+                """),
+    'nn': ("Nearest Neighbour (Greedy)", """
                 - This simpler method starts at the hotel and **always goes to the closest unvisited attraction**.
                 - It is **fast** and intuitive but doesn't always give the shortest total route.
                 
@@ -350,47 +307,100 @@ if st.session_state.get("tour_generated"):
                 3. Repeat until all are visited.
                 
                 **Best for:** Quick route planning with decent efficiency.
-                """)
-            st.dataframe(greedy_itinerary_df, use_container_width=True, hide_index=True)
-
-            # Add a marker for the starting hotel
-            unit = int(selected_hotel_row['unit']) if pd.notna(selected_hotel_row['unit']) else ""
-            postcode = selected_hotel_row['postcode'] if pd.notna(selected_hotel_row['postcode']) else ""
-            popup_html = (
-                f"<strong>{selected_hotel_row['name']}</strong><br>"
-                f"{str(selected_hotel_row['housenumber'])} {selected_hotel_row['street']}{(' ' + str(unit)) if unit else ''}, "
-                f"{selected_hotel_row['city']}, {selected_hotel_row['province']} {postcode}<br>"
-            )
-            folium.Marker(
-                location=[selected_hotel_row.geometry.y, selected_hotel_row.geometry.x],
-                popup=folium.Popup(popup_html, max_width=300),
-                icon=folium.Icon(color="black", icon="bed", prefix="fa")
-            ).add_to(greedy_tour_map)
-
-            # Add markers for the attractions
-            for attraction in sorted_attractions.itertuples():
-                # Build an HTML popup containing the attraction's info:
-                popup_html = (
-                    f"<strong>{attraction.name}</strong><br>"
-                    f"{attraction._4}<br>"
-                    f"{attraction._5}<br>"
-                    f"<em>Distance: {attraction.distance_km:.2f} km</em>"
-                )
-                folium.Marker(
-                    location=[attraction.lat, attraction.lon],
-                    popup=folium.Popup(popup_html, max_width=300),
-                    icon=folium.Icon(color="darkblue", icon="star", prefix="fa")
-                ).add_to(greedy_tour_map)
-
-            # Add the walking tour path
-            folium.PolyLine(
-                locations=greedy_route_coords,
-                color="blue",
-                weight=5,
-                opacity=0.7
-            ).add_to(greedy_tour_map)
-
-            # Display the tour map
-            st_folium(greedy_tour_map, width="100%")
-        except Exception as e:
-            st.error(f"Could not generate walking tour path: {e}")
\ No newline at end of file
+                """),
+}
+
+def show_tour(algorithm, selected_hotel_row, sorted_attractions, route):
+    """Display the itinerary and the map of one computed walking tour."""
+    title, description = TOUR_DESCRIPTIONS[algorithm]
+    route_coords, ordered_stop_names, segment_distances = route
+
+    # Create a new map centered on the selected hotel
+    tour_map = folium.Map(location=[selected_hotel_row.geometry.y, selected_hotel_row.geometry.x], zoom_start=14)
+
+    # build an itinerary for the tour
+    # note: If there are N stops, there are N-1 segments.
+    itinerary_data = []
+    for i in range(len(segment_distances)):
+        from_stop = ordered_stop_names[i]
+        to_stop   = ordered_stop_names[i+1]
+        # Convert meters to kilometers
+        distance_km = segment_distances[i] / 1000
+        itinerary_data.append({
+            "From": from_stop,
+            "To": to_stop,
+            "Distance (km)": f"{distance_km:.2f}"
+        })
+    itinerary_df = pd.DataFrame(itinerary_data)
+    st.subheader("{} Itinerary (Total Distance: {:.2f} km)".format(title, sum(segment_distances) / 1000))
+    with st.expander(f"How does {title} work?"):
+        st.markdown(description)
+
+    st.dataframe(itinerary_df, use_container_width=True, hide_index=True)
+
+    # Add a marker for the starting hotel          
+    unit = int(selected_hotel_row['unit']) if pd.notna(selected_hotel_row['unit']) else ""
+    postcode = selected_hotel_row['postcode'] if pd.notna(selected_hotel_row['postcode']) else ""
+    popup_html = (
+        f"<strong>{selected_hotel_row['name']}</strong><br>"
+        f"{str(selected_hotel_row['housenumber'])} {selected_hotel_row['street']}{(' ' + str(unit)) if unit else ''}, "
+        f"{selected_hotel_row['city']}, {selected_hotel_row['province']} {postcode}<br>"
+    )
+    folium.Marker(
+        location=[selected_hotel_row.geometry.y, selected_hotel_row.geometry.x],
+        popup=folium.Popup(popup_html, max_width=300),
+        icon=folium.Icon(color="black", icon="bed", prefix="fa")
+    ).add_to(tour_map)
+
+    # Add markers for the attractions
+    for attraction in sorted_attractions.itertuples():
+        # Build an HTML popup containing the attraction's info:
+        popup_html = (
+            f"<strong>{attraction.name}</strong><br>"
+            f"{attraction._4}<br>"
+            f"{attraction._5}<br>"
+            f"<em>Distance: {attraction.distance_km:.2f} km</em>"
+        )
+        folium.Marker(
+            location=[attraction.lat, attraction.lon],
+            popup=folium.Popup(popup_html, max_width=300),
+            icon=folium.Icon(color="darkblue", icon="star", prefix="fa")
+        ).add_to(tour_map)
+
+    # Add the walking tour path
+    folium.PolyLine(
+        locations=route_coords,
+        color="blue",
+        weight=5,
+        opacity=0.7
+    ).add_to(tour_map)
+
+    # Display the tour map
+    st_folium(tour_map, width="100%", key=f"{algorithm}_tour_map")
+
+if st.session_state.get("tour_generated"):
+    st.subheader("Walking Tour Path Result")
+    st.success(f"Generated a walking tour path from {selected_hotel} to nearby attractions")
+
+    selected_hotel_row = st.session_state.get("selected_hotel")
+    sorted_attractions = st.session_state.get("sorted_attractions")
+    tour_job = st.session_state.get("tour_job")
+
+    if selected_hotel_row is not None and sorted_attractions is not None and tour_job is not None:
+        # one slot per algorithm (in display order), each filled as soon as its route is ready
+        slots = {algorithm: st.empty() for algorithm in tour_job['routes']}
+        pending = dict(tour_job['routes'])
+        while pending:
+            for algorithm, future in list(pending.items()):
+                if not future.done():
+                    # updating the slot also lets Streamlit interrupt this loop on a rerun
+                    slots[algorithm].info(f"Computing the {TOUR_DESCRIPTIONS[algorithm][0]} tour...")
+                    continue
+                del pending[algorithm]
+                with slots[algorithm].container():
+                    try:
+                        show_tour(algorithm, selected_hotel_row, sorted_attractions, future.result())
+                    except Exception as e:
+                        st.error(f"Could not generate walking tour path: {e}")
+            if pending:
+                wait(pending.values(), timeout=0.5, return_when=FIRST_COMPLETED)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from opening_hours import HOURS_COLUMNS
+from vancouver_amenities import amenity_categories
+
+AMENITIES_PATH = 'data/vancouver_amenities.csv'
+HOTELS_PATH = 'data/vancouver_hotels.csv'
+
+# compact tables loaded once per process and shared by all callers (read-only), keyed by csv path
+# cleared by clear_tables when the stored data changes
+_tables = {}
+
+# bumped by clear_tables before and after every change to the stored data (so it is odd while a change
+# is being applied); caches only keep results computed from one unchanged version (see is_current)
+_generation = 0
+
+# amenity columns held in memory; the raw 'tags' and 'timestamp' are not loaded (the opening hours
+# are parsed from the tags once, during ingestion)
+AMENITY_COLUMNS = ['lat', 'lon', 'amenity', 'name', 'category'] + HOURS_COLUMNS
+
+def load_amenity_table(path=AMENITIES_PATH):
+    """
+    Load the stored amenities into a compact table (cached).
+
+    Coordinates are float64 arrays (exact, so amenities still match on KEY_COLUMNS), amenity, name and
+    category are categorical codes and the opening-hours masks are nullable uint32. No geometry is
+    created; use to_geodataframe at the GeoPandas boundary.
+
+    Returns:
+    - DataFrame with the AMENITY_COLUMNS, in the row order of the stored csv.
+    """
+    if path not in _tables:
+        dtypes = {'amenity': 'category', 'name': 'category', 'category': pd.CategoricalDtype(list(amenity_categories))}
+        dtypes.update({column: 'UInt32' for column in HOURS_COLUMNS})
+        _tables[path] = pd.read_csv(path, usecols=AMENITY_COLUMNS, dtype=dtypes)[AMENITY_COLUMNS]
+    return _tables[path]
+
+def load_hotel_table(path=HOTELS_PATH):
+    """
+    Load the hotels into a compact table (cached): the WKT points are parsed into float64 'lat'/'lon'
+    columns and repeated address fields are categorical. No geometry is created.
+    """
+    if path not in _tables:
+        hotels = pd.read_csv(path, dtype={'city': 'category', 'province': 'category'})
+        coords = hotels.pop('geometry').str.extract(r'POINT \(([-\d.eE]+) ([-\d.eE]+)\)').astype(np.float64)
+        hotels['lon'], hotels['lat'] = coords[0], coords[1]
+        _tables[path] = hotels
+    return _tables[path]
+
+def to_geodataframe(table):
+    """
+    Create point geometry from the 'lon'/'lat' columns of a compact table (the GeoPandas boundary).
+
+    Returns:
+    - A GeoDataFrame in EPSG:4326 (a new frame; the shared table is not modified).
+    """
+    return gpd.GeoDataFrame(table, geometry=gpd.points_from_xy(table['lon'], table['lat']), crs="EPSG:4326")
+
+def table_generation():
+    """
+    Return the current version of the stored data; read it before loading a table to build a cache entry.
+    """
+    return _generation
+
+def is_current(generation):
+    """
+    Check that the stored data has not changed (and no change was in progress) since generation was read,
+    i.e. that a result computed from the tables may be cached.
+    """
+    return generation % 2 == 0 and generation == _generation
+
+def clear_tables():
+    """
+    Drop the loaded tables; they are reloaded on demand.
+
+    Call it before writing a change to the stored data and again once the caches were updated for it.
+    """
+    global _generation
+    _generation += 1
+    _tables.clear()
@@ -0,0 +1,243 @@
+import threading
+import numpy as np
+import pandas as pd
+from scipy.signal import fftconvolve
+from scipy.sparse import csr_matrix
+from opening_hours import is_open_at, hour_of_week
+from spatial_index import to_projected_xy
+from hotel_ranking import AMENITY_CATEGORIES
+from data_store import load_amenity_table, table_generation, is_current
+
+# categories with a grid plane ('others' is never ranked)
+GRID_CATEGORIES = [category for category in AMENITY_CATEGORIES if category != 'others']
+
+# precomputed density grids, keyed by (buffer_m, cell_m, open_at), least recently used first
+# kept up to date by update_density_grids when amenities change; shared by all session threads (guarded by _grids_lock)
+_grids = {}
+_grids_lock = threading.Lock()
+
+# each entry holds a dense counts grid per category (about 11 MB for the default grid), so only the
+# most recently used grids are kept; evicted grids are rebuilt on demand
+MAX_GRIDS = 4
+
+def disk_kernel(radius, cell_m, samples=8):
+    """
+    Return a kernel holding the fraction of each cell (relative to the center cell) that lies
+    within radius, estimated on a samples x samples sub-grid per cell.
+    """
+    reach = int(np.ceil(radius / cell_m - 0.5))
+    sub = (np.arange(samples) + 0.5) / samples - 0.5
+    offsets = (np.arange(-reach, reach + 1)[:, None] + sub[None, :]).ravel() * cell_m
+    inside = np.hypot(offsets[:, None], offsets[None, :]) <= radius
+    size = 2 * reach + 1
+    return inside.reshape(size, samples, size, samples).mean(axis=(1, 3))
+
+def round_counts(values):
+    """
+    Round convolved counts half up; the small offset keeps exact halves from rounding differently
+    depending on floating point noise (full grid versus re-convolved window).
+    """
+    return np.floor(np.asarray(values) + 0.5 + 1e-6).astype(np.int64)
+
+def compact(counts):
+    """
+    Round counts and store them in the smallest unsigned integer type that holds them.
+    """
+    counts = round_counts(counts)
+    return counts.astype(np.min_scalar_type(max(counts.max(), 1)))
+
+def store(grids, code, values):
+    """
+    Write the counts grid of one category back, widening the grid's integer type if the values need it.
+    """
+    dtype = np.promote_types(grids['counts'].dtype, np.min_scalar_type(max(values.max(), 1)))
+    if dtype != grids['counts'].dtype:
+        grids['counts'] = grids['counts'].astype(dtype)
+    grids['counts'][code] = values
+
+def get_density_grids(buffer_m=350, cell_m=50, open_at=None):
+    """
+    Build (or return the cached) per-category grids of amenity counts within buffer_m.
+
+    Amenities are binned into cell_m x cell_m cells in EPSG:26910 and each category grid is
+    convolved with a disk of radius buffer_m, so cell (row, col) holds the (rounded) number of
+    amenities within buffer_m of that cell's center. Any location can then be scored with a single
+    lookup (see lookup_counts) instead of a spatial query; counts are approximate at the scale of
+    a cell (a few percent off the exact score_hotels counts with the default 50 m cells).
+
+    Arguments:
+    - buffer_m: Buffer distance in meters (as in score_hotels).
+    - cell_m: Grid cell size in meters.
+    - open_at: Optional datetime or hour-of-week index; only amenities open at that time are counted.
+
+    Returns:
+    - A dictionary with the grid 'origin' (x, y of the lower-left corner), 'cell_m', 'buffer_m',
+      'open_at', 'kernel', the 'extent' (min and max x, y of the amenities the grid covers), the
+      'binned' amenity counts per cell (one sparse matrix per category, kept for update_density_grids)
+      and the 'counts' within buffer_m, an array of shape (len(GRID_CATEGORIES), rows, columns).
+    """
+    open_at = hour_of_week(open_at) if open_at is not None else None
+    key = (buffer_m, cell_m, open_at)
+    with _grids_lock:
+        if key in _grids:
+            _grids[key] = _grids.pop(key)  # mark as most recently used
+            return _grids[key]
+
+    # build outside the lock; two sessions racing on a new key build the same grid
+    generation = table_generation()
+    amenities = load_amenity_table()
+    xy = to_projected_xy(amenities['lon'], amenities['lat'])
+
+    # pad the extent by the buffer so locations near the edge see all amenities within buffer_m
+    origin = xy.min(axis=0) - buffer_m
+    columns, rows = (np.ceil((xy.max(axis=0) + buffer_m - origin) / cell_m).astype(int) + 1)
+
+    # bin the amenities of each category into the grid
+    codes = pd.Index(GRID_CATEGORIES).get_indexer(amenities['category'])  # -1 for 'others'
+    keep = codes >= 0
+    if open_at is not None:
+        keep &= is_open_at(amenities, open_at)
+    cells = np.floor((xy[keep] - origin) / cell_m).astype(np.int64)
+    binned = [
+        csr_matrix((np.ones(mine.sum(), dtype=np.int32), (cells[mine, 1], cells[mine, 0])), shape=(rows, columns))
+        for mine in (codes[keep] == code for code in range(len(GRID_CATEGORIES)))
+    ]
+
+    # count within buffer_m of each cell center: convolve each category with a disk
+    kernel = disk_kernel(buffer_m, cell_m)
+    counts = compact([fftconvolve(grid.toarray(), kernel, mode='same') for grid in binned])
+
+    grids = {
+        'origin': origin,
+        'cell_m': cell_m,
+        'buffer_m': buffer_m,
+        'open_at': open_at,
+        'kernel': kernel,
+        'extent': np.concatenate([xy.min(axis=0), xy.max(axis=0)]),
+        'binned': binned,
+        'counts': counts,
+    }
+    with _grids_lock:
+        if not is_current(generation):
+            return grids  # the amenities changed while building; update_density_grids may have missed this grid
+        grids = _grids.setdefault(key, grids)
+        while len(_grids) > MAX_GRIDS:
+            del _grids[next(iter(_grids))]
+    return grids
+
+def lookup_counts(grids, lon, lat):
+    """
+    Look up the amenity counts within the grid's buffer for arbitrary locations in constant time.
+
+    Arguments:
+    - grids: Density grids from get_density_grids.
+    - lon, lat: Scalars or arrays of locations in EPSG:4326.
+
+    Returns:
+    - An integer array of shape (n, len(GRID_CATEGORIES)); locations outside the grid get zero counts.
+    """
+    xy = to_projected_xy(np.atleast_1d(lon), np.atleast_1d(lat))
+    counts = grids['counts']
+    cells = np.floor((xy - grids['origin']) / grids['cell_m']).astype(np.int64)
+    inside = (cells[:, 0] >= 0) & (cells[:, 0] < counts.shape[2]) & (cells[:, 1] >= 0) & (cells[:, 1] < counts.shape[1])
+
+    result = np.zeros((len(xy), len(GRID_CATEGORIES)), dtype=np.int64)
+    result[inside] = counts[:, cells[inside, 1], cells[inside, 0]].T
+    return result
+
+def score_location(lon, lat, ranking, buffer_m=350, open_at=None, reference=None):
+    """
+    Score arbitrary locations (e.g. a clicked map point or a new listing) like score_hotels does,
+    using constant-time density grid lookups.
+
+    Arguments:
+    - lon, lat: Scalars or arrays of locations in EPSG:4326.
+    - ranking: Dictionary mapping amenity categories to their weights.
+    - buffer_m: Buffer distance in meters.
+    - open_at: Optional datetime or hour-of-week index; only amenities open at that time are counted.
+    - reference: Optional (lon, lat) arrays of reference locations (e.g. the hotels); the best of them
+      is mapped to 100 so that locations share the 0–100 scale of the hotel ranking.
+
+    Returns:
+    - DataFrame with the amenity 'count_<category>' and weighted 'score_<category>' columns and the
+      'total_score' (raw weighted sum without a reference, above 100 when a location beats the reference).
+    """
+    grids = get_density_grids(buffer_m, open_at=open_at)
+    counts = lookup_counts(grids, lon, lat)
+    columns = [GRID_CATEGORIES.index(category) for category in ranking]
+    weights = np.array(list(ranking.values()))
+    weighted = counts[:, columns] * weights
+
+    results = pd.DataFrame(index=range(len(counts)))
+    for i, category in enumerate(ranking):
+        results[f'count_{category.replace(" ", "_")}'] = counts[:, columns[i]]
+        results[f'score_{category.replace(" ", "_")}'] = weighted[:, i]
+    results['total_score'] = weighted.sum(axis=1)
+
+    # normalize against the best reference location
+    if reference is not None:
+        max_total_score = (lookup_counts(grids, *reference)[:, columns] * weights).sum(axis=1).max()
+        results['total_score'] = results['total_score'] / max_total_score * 100 if max_total_score > 0 else 0
+        results['total_score'] = results['total_score'].round(2)
+    return results
+
+def update_density_grids(removed, added):
+    """
+    Adjust the cached density grids for removed and added amenities.
+
+    Only the cells within buffer_m of a changed amenity are re-convolved. A grid is dropped instead
+    (and rebuilt on demand) when an added amenity lies outside the extent it was built for, as a full
+    rebuild would enlarge the grid to cover it. Removing the outermost amenities does not shrink the
+    extent; a full rebuild would then use a smaller grid with shifted cell boundaries, so its lookups
+    can differ from the updated grid at the scale of a cell.
+
+    Arguments:
+    - removed: DataFrame of removed amenities (stored format: lat, lon, category, hours columns).
+    - added: DataFrame of added amenities (stored format).
+    """
+    changed = pd.concat([removed.assign(change=-1), added.assign(change=1)], ignore_index=True)
+    if changed.empty:
+        return
+    xy = to_projected_xy(changed['lon'], changed['lat'])
+    codes = pd.Index(GRID_CATEGORIES).get_indexer(changed['category'])  # -1 for 'others'
+
+    with _grids_lock:
+        for key, grids in list(_grids.items()):
+            change = changed['change'].to_numpy() * (codes >= 0)
+            if grids['open_at'] is not None:
+                change = change * is_open_at(changed, grids['open_at'])
+
+            # added amenities outside the grid's extent: rebuild the grid on demand
+            low, high = grids['extent'][:2], grids['extent'][2:]
+            if ((change > 0) & ((xy < low) | (xy > high)).any(axis=1)).any():
+                del _grids[key]
+                continue
+
+            _, rows, columns = grids['counts'].shape
+            reach = grids['kernel'].shape[0] // 2
+            cells = np.floor((xy - grids['origin']) / grids['cell_m']).astype(np.int64)
+            inside = (cells[:, 0] >= 0) & (cells[:, 0] < columns) & (cells[:, 1] >= 0) & (cells[:, 1] < rows)
+
+            # update one affected category at a time
+            for code in np.unique(codes[change != 0]):
+                mine = (codes == code) & (change != 0)
+                delta = csr_matrix((change[mine & inside], (cells[mine & inside, 1], cells[mine & inside, 0])), shape=(rows, columns))
+                binned = (grids['binned'][code] + delta).astype(np.int32)
+                binned.eliminate_zeros()
+                grids['binned'][code] = binned
+                counts = grids['counts'][code].astype(np.int64)
+
+                for column, row in cells[mine]:
+                    # the cells within buffer_m of the changed amenity (clipped to the grid)
+                    r0, r1 = max(row - reach, 0), min(row + reach + 1, rows)
+                    c0, c1 = max(column - reach, 0), min(column + reach + 1, columns)
+                    if r0 >= r1 or c0 >= c1:
+                        continue
+
+                    # re-convolve them from the binned counts around them
+                    p0, p1 = max(r0 - reach, 0), min(r1 + reach, rows)
+                    q0, q1 = max(c0 - reach, 0), min(c1 + reach, columns)
+                    window = fftconvolve(binned[p0:p1, q0:q1].toarray(), grids['kernel'], mode='same')
+                    counts[r0:r1, c0:c1] = round_counts(window[r0 - p0:r1 - p0, c0 - q0:c1 - q0])
+
+                store(grids, code, counts)
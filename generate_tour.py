@@ -1,8 +1,9 @@
 import osmnx as ox
 import networkx as nx
 import streamlit as st
+from concurrent.futures import CancelledError
+from routing_graph import build_routing_graph, nearest_nodes, shortest_paths, path_nodes, node_coords
 
-@st.cache_data(show_spinner="Finding the best route...")
 def get_osmnx_graph(center, dist):
     """
     Download the OSMnx walking network graph centered at a given point.
@@ -18,17 +19,39 @@ def get_osmnx_graph(center, dist):
     G = ox.graph_from_point(center, dist=dist, network_type='walk')
     return G
 
-def generate_tsp_route(selected_hotel, attractions):
+# cache_resource shares one graph object between sessions and the background tour workers
+# (the graph is only read, never modified)
+@st.cache_resource(show_spinner=False)
+def get_routing_graph(center, dist):
     """
-    Generate a tour route using a Traveling Salesman Problem (TSP) solution.
+    Download the walking network and convert it once into the compact CSR routing graph.
+
+    Only the CSR arrays are cached; the networkx graph is dropped after the conversion.
+
+    Arguments:
+    - center: A tuple (latitude, longitude) for the center point.
+    - dist: Distance in meters to download the OSMnx graph.
+
+    Returns:
+    - The routing graph (see routing_graph.build_routing_graph).
+    """
+    return build_routing_graph(get_osmnx_graph(center, dist))
+
+def prepare_tour_graph(selected_hotel, attractions):
+    """
+    Download the walking network around the hotel, snap the hotel and attractions to it and
+    compute the shortest paths from every stop.
+
+    Both tour algorithms can share the result, so the graph is downloaded, the points are
+    snapped and the shortest paths are searched only once per tour.
 
     Arguments:
     - selected_hotel: A row from the hotels GeoDataFrame for the selected hotel.
-    - attractions: A pandas DataFrame of attractions with 'lat' and 'lon' columns.
-    - buffer_dist: Distance in meters to download the OSMnx walking network (default=5000).
+    - attractions: A pandas DataFrame of attractions with 'lat', 'lon' and 'distance_km' columns.
 
     Returns:
-    - List of coordinate tuples (lat, lon) representing the route.
+    - A dictionary with the routing 'graph', the snapped 'nodes' (hotel first), the matching 'stop_names',
+      the stop-to-stop walking 'distances' in meters and the shortest path 'predecessors' from each stop.
     """
     # Get the hotel distance from the furthest attraction
     max_dist = attractions['distance_km'].max()
@@ -38,60 +61,78 @@ def generate_tsp_route(selected_hotel, attractions):
     center = (selected_hotel.geometry.y, selected_hotel.geometry.x)
 
     # Download the walking network using osmnx
-    G = get_osmnx_graph(center, dist=buffer_dist)
+    graph = get_routing_graph(center, dist=buffer_dist)
     
     # Prepare the list of points starting with the hotel and then all attractions
-    tour_points = [(selected_hotel.geometry.y, selected_hotel.geometry.x)]
-    stop_names = [selected_hotel['name']]
-    tour_points += list(zip(attractions['lat'], attractions['lon']))
-    stop_names += list(attractions['name'])
-    
-    # Map each point to the nearest node in the osmnx graph
-    nodes = []
-    for lat, lon in tour_points:
-        # Note: osmnx.nearest_nodes expects (longitude, latitude)
-        node = ox.distance.nearest_nodes(G, lon, lat)
-        nodes.append(node)
-    
-    # Build a complete graph of these nodes using networkx
+    lats = [selected_hotel.geometry.y] + list(attractions['lat'])
+    lons = [selected_hotel.geometry.x] + list(attractions['lon'])
+    stop_names = [selected_hotel['name']] + list(attractions['name'])
+
+    # Map each point to the nearest node in the graph
+    nodes = nearest_nodes(graph, lons, lats)
+
+    # Dijkstra from all stops at once; distances[i][j] is the walking distance from stop i to stop j
+    all_distances, predecessors = shortest_paths(graph, nodes)
+    distances = all_distances[:, nodes]
+
+    return {'graph': graph, 'nodes': nodes, 'stop_names': stop_names, 'distances': distances, 'predecessors': predecessors}
+
+def check_cancelled(cancelled):
+    """
+    Raise CancelledError if the tour was cancelled (e.g. the user picked another hotel).
+    """
+    if cancelled is not None and cancelled.is_set():
+        raise CancelledError()
+
+def generate_tsp_route(selected_hotel, attractions, tour_graph=None, cancelled=None):
+    """
+    Generate a tour route using a Traveling Salesman Problem (TSP) solution.
+
+    Arguments:
+    - selected_hotel: A row from the hotels GeoDataFrame for the selected hotel.
+    - attractions: A pandas DataFrame of attractions with 'lat' and 'lon' columns.
+    - tour_graph: Optional result of prepare_tour_graph to reuse (prepared here if not given).
+    - cancelled: Optional threading.Event; the computation stops with CancelledError once it is set.
+
+    Returns:
+    - List of coordinate tuples (lat, lon) representing the route.
+    """
+    # Get the walking network and the snapped hotel/attraction nodes
+    if tour_graph is None:
+        tour_graph = prepare_tour_graph(selected_hotel, attractions)
+    graph, nodes, stop_names = tour_graph['graph'], tour_graph['nodes'], tour_graph['stop_names']
+    distances, predecessors = tour_graph['distances'], tour_graph['predecessors']
+    check_cancelled(cancelled)
+    
+    # Build a complete graph of the stops using networkx, weighted by the walking distances
     complete_graph = nx.complete_graph(len(nodes))
-    for i, u in enumerate(nodes):
-        for j, v in enumerate(nodes):
-            if i != j:
-                # Compute the shortest path length between nodes u and v in G
-                try:
-                    length = nx.shortest_path_length(G, u, v, weight='length')
-                except nx.NetworkXNoPath:
-                    length = float('inf')
-                complete_graph[i][j]['weight'] = length
+    for i, j in complete_graph.edges:
+        complete_graph[i][j]['weight'] = distances[i][j]
     
     # Solve the TSP on the complete graph (using networkx's approximation algo)
     tsp_order = nx.approximation.traveling_salesman_problem(complete_graph, weight='weight')
+    check_cancelled(cancelled)
 
     # Get the stops (names and original coordinates) in TSP order
     ordered_stop_names = [stop_names[i] for i in tsp_order]
     
-    # Convert TSP order indices back to OSMnx node IDs
-    ordered_nodes = [nodes[i] for i in tsp_order]
-    
-    # Generate the full route by concatenating shortest paths between successive nodes
+    # Generate the full route by concatenating shortest paths between successive stops
     full_route = []
     segment_distances = [] # store the distances between segments
-    for i in range(len(ordered_nodes) - 1):
-        route_segment = nx.shortest_path(G, ordered_nodes[i], ordered_nodes[i+1], weight='length')
+    for i, j in zip(tsp_order[:-1], tsp_order[1:]):
+        route_segment = path_nodes(predecessors[i], nodes[i], nodes[j])
         # Get the distance of the segment
-        distance_segment = nx.shortest_path_length(G, ordered_nodes[i], ordered_nodes[i+1], weight='length')
-        segment_distances.append(distance_segment)
+        segment_distances.append(float(distances[i][j]))
         # Avoid duplicating nodes between segments
         full_route.extend(route_segment[:-1])
-    full_route.append(ordered_nodes[-1])
+    full_route.append(nodes[tsp_order[-1]])
     
     # Extract coordinate pairs from the full route
-    route_coords = [(G.nodes[node]['y'], G.nodes[node]['x']) for node in full_route]
+    route_coords = node_coords(graph, full_route)
     
     return route_coords, ordered_stop_names, segment_distances
 
-def generate_nn_route(selected_hotel, attractions, buffer_dist=5000):
+def generate_nn_route(selected_hotel, attractions, buffer_dist=5000, tour_graph=None, cancelled=None):
     """
     Generate a tour route using a greedy nearest neighbor approach.
     
@@ -99,34 +140,19 @@ def generate_nn_route(selected_hotel, attractions, buffer_dist=5000):
     - selected_hotel: A row from the hotels GeoDataFrame for the selected hotel.
     - attractions: A pandas DataFrame of attractions with 'lat' and 'lon' columns.
     - buffer_dist: Distance in meters to download the OSMnx walking network.
+    - tour_graph: Optional result of prepare_tour_graph to reuse (prepared here if not given).
+    - cancelled: Optional threading.Event; the computation stops with CancelledError once it is set.
     
     Returns:
     - route_coords: List of coordinate tuples (lat, lon) representing the full route (for mapping).
     - ordered_stop_names: List of stop names (hotel + attractions) in the order visited.
     - segment_distances: List of distances (in meters) for each segment between consecutive stops.
     """
-    # Get the hotel distance from the furthest attraction
-    max_dist = attractions['distance_km'].max()
-    buffer_dist = int(max_dist * 1000) + 500  # Add a buffer of 500m
-    
-    # Center the graph on the hotel location
-    center = (selected_hotel.geometry.y, selected_hotel.geometry.x)
-
-    # Download the walking network using osmnx
-    G = get_osmnx_graph(center, dist=buffer_dist)
-    
-    # Build a list of points and stop names: hotel first, then all attractions
-    tour_points = [(selected_hotel.geometry.y, selected_hotel.geometry.x)]
-    stop_names = [selected_hotel['name']]
-    tour_points += list(zip(attractions['lat'], attractions['lon']))
-    stop_names += list(attractions['name'])
-    
-    # Map each point to its nearest node in the graph
-    nodes = []
-    for lat, lon in tour_points:
-        # osmnx.nearest_nodes expects (longitude, latitude)
-        node = ox.distance.nearest_nodes(G, lon, lat)
-        nodes.append(node)
+    # Get the walking network and the snapped hotel/attraction nodes
+    if tour_graph is None:
+        tour_graph = prepare_tour_graph(selected_hotel, attractions)
+    graph, nodes, stop_names = tour_graph['graph'], tour_graph['nodes'], tour_graph['stop_names']
+    distances, predecessors = tour_graph['distances'], tour_graph['predecessors']
     
     n = len(nodes)
     visited = [False] * n
@@ -140,14 +166,12 @@ def generate_nn_route(selected_hotel, attractions, buffer_dist=5000):
     
     # Greedy loop: choose the nearest unvisited node at each step
     for _ in range(1, n):
+        check_cancelled(cancelled)
         best_distance = float('inf')
         best_idx = None
         for j in range(n):
             if not visited[j]:
-                try:
-                    d = nx.shortest_path_length(G, nodes[current], nodes[j], weight='length')
-                except nx.NetworkXNoPath:
-                    d = float('inf')
+                d = float(distances[current][j])  # inf if there is no path
                 if d < best_distance:
                     best_distance = d
                     best_idx = j
@@ -161,19 +185,19 @@ def generate_nn_route(selected_hotel, attractions, buffer_dist=5000):
     # Build the full route by concatenating shortest paths between stops in the determined order
     full_route = []
     for i in range(len(order) - 1):
-        route_segment = nx.shortest_path(G, nodes[order[i]], nodes[order[i+1]], weight='length')
+        route_segment = path_nodes(predecessors[order[i]], nodes[order[i]], nodes[order[i+1]])
         # Avoid duplicating the last node (except for the final segment)
         full_route.extend(route_segment[:-1])
     full_route.append(nodes[order[-1]])
 
     # Add cyclic return to the hotel
-    return_segment = nx.shortest_path(G, nodes[order[-1]], nodes[0], weight='length')
+    return_segment = path_nodes(predecessors[order[-1]], nodes[order[-1]], nodes[0])
     full_route.extend(return_segment[1:])  # avoid duplicating the first node
-    segment_distances.append(nx.shortest_path_length(G, nodes[order[-1]], nodes[0], weight='length'))
+    segment_distances.append(float(distances[order[-1]][0]))
     order.append(0)  # return to hotel in the order list
     
-    # Convert node IDs to coordinate pairs (lat, lon) for mapping
-    route_coords = [(G.nodes[node]['y'], G.nodes[node]['x']) for node in full_route]
+    # Convert node indices to coordinate pairs (lat, lon) for mapping
+    route_coords = node_coords(graph, full_route)
     
     # Get the ordered stop names in the sequence determined by the greedy approach
     ordered_stop_names = [stop_names[i] for i in order]
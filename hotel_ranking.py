@@ -1,12 +1,35 @@
-import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point
+import numpy as np
+import hashlib
+import threading
+from opening_hours import is_open_at, hour_of_week, HOURS_COLUMNS
+from scipy.sparse import csr_matrix, hstack
+from spatial_index import build_grid_index, count_within, parallel_count_within, query_radius, to_projected_xy
+from vancouver_amenities import amenity_categories, match_amenities
+from data_store import load_amenity_table, to_geodataframe, table_generation, is_current
+
+# columns of the hotel x category count matrices
+AMENITY_CATEGORIES = list(amenity_categories)
+
+# cached hotel x category count matrices, keyed by (hotel set, buffer_m, open_at), least recently used first
+# kept up to date by update_counts when amenities change; shared by all session threads (guarded by _count_lock)
+_count_cache = {}
+_count_lock = threading.Lock()
+
+# count matrices kept (one per hotel set, buffer and opening time); evicted ones are recounted on demand
+MAX_COUNTS = 16
+
+# cached sparse hotel x amenity incidence matrices, keyed by (hotel set, buffer_m)
+# kept up to date by update_incidence when amenities change (guarded by _incidence_lock)
+_incidence_cache = {}
+_incidence_lock = threading.Lock()
+
+# amenity fields kept alongside the incidence matrix columns
+INCIDENCE_COLUMNS = ['lat', 'lon', 'amenity', 'name', 'category'] + HOURS_COLUMNS
 
 def load_amenities():
-    amenities = pd.read_csv("data/vancouver_amenities.csv")
-    amenities['geometry'] = amenities.apply(lambda row: Point(row['lon'], row['lat']), axis=1)
-    amenities = gpd.GeoDataFrame(amenities, geometry='geometry', crs="EPSG:4326") # convert to crs: EPSG:4326 for folium
-    return amenities
+    # point geometry is only created here, for GeoPandas callers; scoring reads the compact table directly
+    return to_geodataframe(load_amenity_table()) # crs: EPSG:4326 for folium
 
 def get_score_color(score, max_score):
     ratio = score / max_score if max_score > 0 else 0
@@ -19,54 +42,253 @@ def get_score_color(score, max_score):
     else:
         return 'darkred'
 
-def score_hotels(hotels_gdf, ranking, buffer_m=350):
+def hotels_key(hotel_xy):
+    """
+    Identify a hotel set by a hash of its projected coordinates (used as a cache key).
+    """
+    return hashlib.sha1(np.ascontiguousarray(hotel_xy).tobytes()).hexdigest()
+
+def get_category_counts(hotel_xy, buffer_m=350, open_at=None, workers=None):
+    """
+    Count the amenities of each category within buffer_m of each hotel (cached).
+
+    Arguments:
+    - hotel_xy: Array of shape (n, 2) with hotel coordinates in EPSG:26910.
+    - buffer_m: Buffer distance in meters.
+    - open_at: Optional datetime or hour-of-week index; only amenities open at that time are counted.
+    - workers: Optional number of processes used to count (see spatial_index.parallel_count_within).
+
+    Returns:
+    - An integer array of shape (n, len(AMENITY_CATEGORIES)) with the counts.
+    """
+    open_at = hour_of_week(open_at) if open_at is not None else None
+    key = (hotels_key(hotel_xy), buffer_m, open_at)
+    with _count_lock:
+        if key in _count_cache:
+            _count_cache[key] = _count_cache.pop(key)  # mark as most recently used
+            return _count_cache[key]['counts']
+
+    generation = table_generation()
+    amenities = load_amenity_table()
+
+    # only count amenities open at the requested time (amenities with unknown hours are kept)
+    if open_at is not None:
+        amenities = amenities[is_open_at(amenities, open_at)]
+
+    # encode categories as integer codes (column in the count matrix)
+    amenity_codes = pd.Categorical(amenities['category'], categories=AMENITY_CATEGORIES).codes.astype(np.int64)
+    amenity_xy = to_projected_xy(amenities['lon'], amenities['lat'])
+
+    # count amenities within buffer_m of each hotel
+    index = build_grid_index(amenity_xy, cell_size=buffer_m)
+    if workers is None:
+        counts = count_within(index, amenity_xy, amenity_codes, len(AMENITY_CATEGORIES), hotel_xy, buffer_m)
+    else:
+        counts = parallel_count_within(index, amenity_xy, amenity_codes, len(AMENITY_CATEGORIES), hotel_xy, buffer_m, workers=workers)
+
+    with _count_lock:
+        if not is_current(generation):
+            return counts  # the amenities changed while counting; update_counts may have missed this result
+        _count_cache[key] = {'hotel_xy': hotel_xy, 'buffer_m': buffer_m, 'open_at': open_at, 'counts': counts}
+        while len(_count_cache) > MAX_COUNTS:
+            del _count_cache[next(iter(_count_cache))]
+    return counts
+
+def update_counts(removed, added):
+    """
+    Adjust the cached count matrices for removed and added amenities.
+
+    Only the hotels whose buffer covers a changed amenity are touched, so an amenity diff
+    does not require recounting every hotel.
+
+    Arguments:
+    - removed: DataFrame of removed amenities (stored format: lat, lon, category, hours columns).
+    - added: DataFrame of added amenities (stored format).
+    """
+    changed = pd.concat([removed.assign(change=-1), added.assign(change=1)], ignore_index=True)
+    if changed.empty:
+        return
+    changed_xy = to_projected_xy(changed['lon'], changed['lat'])
+    changed_codes = pd.Categorical(changed['category'], categories=AMENITY_CATEGORIES).codes.astype(np.int64)
+
+    with _count_lock:
+        for entry in _count_cache.values():
+            change = changed['change'].to_numpy()
+            if entry['open_at'] is not None:
+                change = change * is_open_at(changed, entry['open_at'])
+
+            # find the hotels within buffer_m of each changed amenity
+            index = build_grid_index(changed_xy, cell_size=entry['buffer_m'])
+            hotel_idx, changed_idx, _ = query_radius(index, changed_xy, entry['hotel_xy'], entry['buffer_m'])
+            np.add.at(entry['counts'], (hotel_idx, changed_codes[changed_idx]), change[changed_idx])
+
+def incidence_matrix(hotel_xy, amenities, buffer_m):
+    """
+    Build the sparse hotel x amenity matrix of distances (in meters) for amenities within buffer_m.
+
+    A stored entry means the amenity is within the buffer; an amenity exactly at the hotel is
+    stored with the smallest positive float32 so that it is not dropped as a sparse zero.
+    """
+    amenity_xy = to_projected_xy(amenities['lon'], amenities['lat'])
+    index = build_grid_index(amenity_xy, cell_size=buffer_m)
+    hotel_idx, amenity_idx, distances = query_radius(index, amenity_xy, hotel_xy, buffer_m)
+    distances = np.maximum(distances, np.finfo(np.float32).tiny).astype(np.float32)
+    return csr_matrix((distances, (hotel_idx, amenity_idx)), shape=(len(hotel_xy), len(amenities)))
+
+def get_incidence(hotel_xy, buffer_m=350):
+    """
+    Return the cached sparse hotel x amenity incidence matrix (with distances) for buffer_m.
+
+    Per-amenity-type weights, category subsets, opening hours and nearby amenity listings are
+    all derived from this matrix with sparse matrix operations, without new spatial queries.
+
+    Arguments:
+    - hotel_xy: Array of shape (n, 2) with hotel coordinates in EPSG:26910.
+    - buffer_m: Buffer distance in meters.
+
+    Returns:
+    - A dictionary with the csr 'matrix' (n_hotels x n_amenities, float32 distances) and the
+      'amenities' DataFrame (INCIDENCE_COLUMNS) whose rows match the matrix columns.
+    """
+    key = (hotels_key(hotel_xy), buffer_m)
+    with _incidence_lock:
+        if key in _incidence_cache:
+            return _incidence_cache[key]
+
+    generation = table_generation()
+    amenities = load_amenity_table()[INCIDENCE_COLUMNS].reset_index(drop=True)
+    entry = {
+        'hotel_xy': hotel_xy,
+        'buffer_m': buffer_m,
+        'matrix': incidence_matrix(hotel_xy, amenities, buffer_m),
+        'amenities': amenities,
+    }
+    with _incidence_lock:
+        if is_current(generation):  # not built from amenities that changed meanwhile
+            _incidence_cache[key] = entry
+    return entry
+
+def update_incidence(removed, added):
+    """
+    Update the cached incidence matrices for removed and added amenities: the columns of removed
+    amenities are dropped and columns for the added amenities are appended.
+
+    Arguments:
+    - removed: DataFrame of removed amenities (stored format).
+    - added: DataFrame of added amenities (stored format).
+    """
+    added = pd.DataFrame(added[INCIDENCE_COLUMNS]).reset_index(drop=True)
+    with _incidence_lock:
+        for key, entry in _incidence_cache.items():
+            # replace the entry as a whole so readers never see a matrix and amenities that do not match
+            keep = ~match_amenities(entry['amenities'], removed)
+            new_columns = incidence_matrix(entry['hotel_xy'], added, entry['buffer_m'])
+            _incidence_cache[key] = dict(
+                entry,
+                matrix=hstack([entry['matrix'][:, keep], new_columns], format='csr'),
+                amenities=pd.concat([entry['amenities'][keep], added], ignore_index=True),
+            )
+
+def weighted_category_scores(incidence, ranking, amenity_weights=None, open_at=None):
+    """
+    Compute weighted per-category scores from an incidence matrix.
+
+    Arguments:
+    - incidence: Result of get_incidence.
+    - ranking: Dictionary mapping amenity categories to their weights (only these categories are scored).
+    - amenity_weights: Optional dictionary mapping amenity types (e.g. 'cafe') to their own weights;
+      other amenity types use the weight of their category.
+    - open_at: Optional datetime or hour-of-week index; only amenities open at that time are counted.
+
+    Returns:
+    - An array of shape (n_hotels, len(ranking)) with the weighted scores.
+    """
+    amenities = incidence['amenities']
+    categories = list(ranking.keys())
+
+    # one weight per amenity (column): its own type weight, or else its category weight
+    weights = amenities['category'].map(ranking)
+    if amenity_weights:
+        weights = amenities['amenity'].map(amenity_weights).fillna(weights)
+    weights = weights.fillna(0).to_numpy(dtype=np.float64)
+    if open_at is not None:
+        weights = weights * is_open_at(amenities, open_at)
+
+    # amenities x categories matrix holding each amenity's weight in its category's column
+    codes = pd.Categorical(amenities['category'], categories=categories).codes
+    ranked = codes >= 0
+    weight_matrix = csr_matrix((weights[ranked], (np.flatnonzero(ranked), codes[ranked])), shape=(len(amenities), len(categories)))
+
+    # the incidence structure (1 per hotel/amenity pair) times the weights
+    matrix = incidence['matrix']
+    within = csr_matrix((np.ones(matrix.nnz), matrix.indices, matrix.indptr), shape=matrix.shape)
+    return (within @ weight_matrix).toarray()
+
+def nearby_amenities(hotels_gdf, hotel_idx, buffer_m=350, category=None, amenity=None, open_at=None, limit=None):
+    """
+    List the amenities within buffer_m of one hotel, nearest first, straight from the incidence matrix.
+
+    Arguments:
+    - hotels_gdf: GeoDataFrame containing hotel data with geometry (the same hotels that were scored).
+    - hotel_idx: Position of the hotel in hotels_gdf.
+    - buffer_m: Buffer distance in meters.
+    - category: Optional amenity category to keep (e.g. 'food & drink').
+    - amenity: Optional amenity type to keep (e.g. 'cafe').
+    - open_at: Optional datetime or hour-of-week index; only amenities open at that time are listed.
+    - limit: Optional maximum number of amenities to return.
+
+    Returns:
+    - DataFrame of nearby amenities with a 'distance_m' column.
+    """
+    hotels_gdf = hotels_gdf.to_crs(epsg=26910)
+    incidence = get_incidence(np.column_stack([hotels_gdf.geometry.x, hotels_gdf.geometry.y]), buffer_m)
+
+    row = incidence['matrix'][hotel_idx]
+    nearby = incidence['amenities'].iloc[row.indices].assign(distance_m=row.data.astype(np.float64).round(1))
+    if category is not None:
+        nearby = nearby[nearby['category'] == category]
+    if amenity is not None:
+        nearby = nearby[nearby['amenity'] == amenity]
+    if open_at is not None:
+        nearby = nearby[is_open_at(nearby, open_at)]
+    nearby = nearby.sort_values('distance_m').drop(columns=HOURS_COLUMNS).reset_index(drop=True)
+    return nearby.head(limit) if limit is not None else nearby
+
+def score_hotels(hotels_gdf, ranking, buffer_m=350, open_at=None, workers=None, amenity_weights=None):
     """
     Score hotels based on the number of amenities within a certain buffer distance.
 
     Parameters:
     - hotels_gdf: GeoDataFrame containing hotel data with geometry.
-    - amenities_gdf: GeoDataFrame containing amenities data with geometry.
-    - ranking: List of amenity categories to rank by.
+    - ranking: Dictionary mapping amenity categories to their weights.
     - buffer_m: Buffer distance in meters.
+    - open_at: Optional datetime or hour-of-week index (0 = Monday 00:00); only amenities open at that time are counted.
+    - workers: Optional number of processes; when set, hotels are counted in chunks across a process pool
+      (useful for very large hotel sets, e.g. a full catalogue re-score).
+    - amenity_weights: Optional dictionary mapping amenity types (e.g. 'cafe', 'bar') to their own weights,
+      overriding the weight of their category; scored from the hotel x amenity incidence matrix.
 
     Returns:
     - DataFrame with hotels and their scores for each amenity category.
     """
     # convert the gdf crs to EPSG:26910 for distance calculations
     hotels_gdf = hotels_gdf.to_crs(epsg=26910)
-    amenities_gdf = load_amenities()
-    amenities_gdf = amenities_gdf.to_crs(epsg=26910)
-    
-    # create a result that stores the scores (total and each categories) of each hotel
-    results = hotels_gdf.copy()
-    results['total_score'] = 0
-    category_scores = {category: [] for category in ranking.keys()}
-
-    for _, hotel in results.iterrows():
-        buffer = hotel.geometry.buffer(buffer_m) # create a buffer around the hotel
-        total_score = 0
-        temp_scores = {}
-
-        for category, weight in ranking.items():
-            # count amenities in the buffer
-            count = amenities_gdf[
-                (amenities_gdf['category'] == category) &
-                (amenities_gdf.geometry.within(buffer))
-            ].shape[0]
-            weighted_score = count * weight
-            temp_scores[category] = weighted_score
-            total_score += weighted_score
-        
-        # append individual category scores
-        for category in ranking:
-            category_scores[category].append(temp_scores[category])
-
-        # add total score
-        results.at[hotel.name, 'total_score'] = total_score
-    
+    hotel_xy = np.column_stack([hotels_gdf.geometry.x, hotels_gdf.geometry.y])
+
+    # weighted amenity counts within buffer_m of each hotel: an (n_hotels, n_categories) matrix
+    categories = list(ranking.keys())
+    if amenity_weights:
+        weighted = weighted_category_scores(get_incidence(hotel_xy, buffer_m), ranking, amenity_weights, open_at)
+    else:
+        counts = get_category_counts(hotel_xy, buffer_m, open_at, workers)
+        weights = np.array([ranking[category] for category in categories])
+        weighted = counts[:, [AMENITY_CATEGORIES.index(category) for category in categories]] * weights
+
     # attach individual category scores to results
-    for category in ranking:
-        results[f'score_{category.replace(" ", "_")}'] = category_scores[category]
+    results = hotels_gdf.copy()
+    results['total_score'] = weighted.sum(axis=1)
+    for i, category in enumerate(categories):
+        results[f'score_{category.replace(" ", "_")}'] = weighted[:, i]
 
     # normalize total score to 0–100
     max_total_score = results['total_score'].max()
@@ -82,4 +304,4 @@ def score_hotels(hotels_gdf, ranking, buffer_m=350):
     # convert back to original CRS
     results = results.to_crs(epsg=4326)
 
-    return results
\ No newline at end of file
+    return results
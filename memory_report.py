@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import issparse
+import data_store
+import hotel_ranking
+import density_grid
+import amenities_cluster
+import ranking_store
+
+def nbytes(obj):
+    """
+    Estimate the memory held by a dataset or cache: numpy arrays, sparse matrices and (deep) DataFrame
+    memory, summed through dictionaries, lists and tuples. Shapely geometries only count as pointers.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        memory = obj.memory_usage(deep=True)
+        return int(memory.sum()) if isinstance(obj, pd.DataFrame) else int(memory)
+    if issparse(obj):
+        return int(obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sum(nbytes(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(value) for value in obj)
+    return 0
+
+def footprint_report():
+    """
+    Report the memory held by the loaded datasets and the process-wide caches built from them.
+
+    Returns:
+    - DataFrame with one row per dataset: 'dataset', 'entries' (table rows or cache entries),
+      'bytes' and 'bytes_per_entry'.
+    """
+    datasets = [(f'table: {path}', table, len(table)) for path, table in data_store._tables.items()]
+    datasets += [
+        ('hotel x category counts', hotel_ranking._count_cache, len(hotel_ranking._count_cache)),
+        ('hotel x amenity incidence', hotel_ranking._incidence_cache, len(hotel_ranking._incidence_cache)),
+        ('density grids', density_grid._grids, len(density_grid._grids)),
+        ('amenity clusters', amenities_cluster._labelled, len(amenities_cluster._labelled)),
+        ('rankings', ranking_store._rankings, len(ranking_store._rankings)),
+    ]
+    report = pd.DataFrame([(name, entries, nbytes(obj)) for name, obj, entries in datasets], columns=['dataset', 'entries', 'bytes'])
+    report['bytes_per_entry'] = (report['bytes'] / report['entries'].clip(lower=1)).round().astype(int)
+    return report
+
+if __name__ == '__main__':
+    # load the datasets and the default caches, then print their footprint
+    hotels = data_store.to_geodataframe(data_store.load_hotel_table())
+    ranking_store.get_ranking(hotels, ranking_store.ranking_key({category: 3 for category in amenities_cluster.CATEGORIES}))
+    amenities_cluster.label_amenities()
+    density_grid.get_density_grids()
+    report = footprint_report()
+    print(report.to_string(index=False))
+    print(f"total: {report['bytes'].sum() / 1e6:.2f} MB")
@@ -0,0 +1,146 @@
+import re
+import numpy as np
+
+# weekly opening hours are stored as one 24-bit mask per weekday (bit h = open during hour h)
+# days follow datetime.weekday(): Monday = 0, ..., Sunday = 6
+WEEKDAYS = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
+HOURS_COLUMNS = [f'hours_{day.lower()}' for day in WEEKDAYS]
+ALWAYS_OPEN = (1 << 24) - 1
+
+# approximate clock times for the solar events used in OSM opening_hours
+SOLAR_TIMES = {'dawn': '06:00', 'sunrise': '06:30', 'sunset': '20:00', 'dusk': '20:30'}
+
+TIME_RANGE = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+DAY_TOKEN = re.compile(r'^(Mo|Tu|We|Th|Fr|Sa|Su|PH|SH)(?:-(Mo|Tu|We|Th|Fr|Sa|Su))?$')
+
+def parse_days(selector):
+    """
+    Parse an OSM weekday selector (e.g. 'Mo-Fr', 'Sa,Su', 'Su,PH') into a list of weekday indices.
+
+    Returns:
+    - A list of weekday indices, or None if the selector cannot be parsed.
+    """
+    days = []
+    for token in selector.split(','):
+        match = DAY_TOKEN.match(token)
+        if match is None:
+            return None
+        start, end = match.groups()
+        if start in ('PH', 'SH'):
+            continue  # public and school holidays are not modelled
+        first = WEEKDAYS.index(start)
+        last = WEEKDAYS.index(end) if end else first
+        # ranges may wrap around the week (e.g. 'Sa-Mo')
+        days += [(first + i) % 7 for i in range((last - first) % 7 + 1)]
+    return days
+
+def parse_times(selector):
+    """
+    Parse an OSM time selector (e.g. '09:00-12:00,13:00-17:00') into a list of (start, end) minutes.
+
+    Returns:
+    - A list of (start, end) tuples in minutes since midnight, or None if the selector cannot be parsed.
+    """
+    for event, clock in SOLAR_TIMES.items():
+        selector = selector.replace(event, clock)
+    ranges = []
+    for token in selector.split(','):
+        match = TIME_RANGE.match(token)
+        if match is None:
+            return None
+        h1, m1, h2, m2 = map(int, match.groups())
+        start, end = h1 * 60 + m1, h2 * 60 + m2
+        if start > 24 * 60 or end > 48 * 60:
+            return None
+        # a range ending before it starts runs past midnight into the next day
+        if end <= start:
+            end += 24 * 60
+        ranges.append((start, end))
+    return ranges
+
+def parse_opening_hours(value):
+    """
+    Parse an OSM opening_hours string into a weekly bitmask with one bit per hour.
+
+    Arguments:
+    - value: The opening_hours tag value (e.g. 'Mo-Th 05:30-19:30; Fr-Su 05:30-20:00').
+
+    Returns:
+    - A list of 7 integers (Monday to Sunday), where bit h is set if the place is open at any
+      time during hour h of that day, or None if the value is missing or cannot be parsed.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    if value == '24/7':
+        return [ALWAYS_OPEN] * 7
+
+    # tolerate common spacing variants: 'Sa, Su 10:00-18:00' and 'Mo-Fr 09:00-17:00, Sa 10:00-14:00'
+    value = re.sub(r'(?<=[a-zH]),\s+(?=[A-Z])', ',', value)
+    value = re.sub(r'(?<=\d),\s*(?=[A-Z])', ';', value)
+
+    # hours of each day set by that day's rules, and the hours they spill past midnight into the next day
+    own = np.zeros((7, 24), dtype=bool)
+    spill = np.zeros((7, 24), dtype=bool)
+    has_rule = False
+    for rule in re.split(r';|\|\|', value):
+        tokens = rule.split()
+        if not tokens:
+            continue
+
+        # a rule is: [weekdays] [times] [off|closed]
+        closed = tokens[-1] in ('off', 'closed')
+        if closed:
+            tokens = tokens[:-1]
+        days = list(range(7))
+        if tokens and tokens[0][0].isupper():
+            days = parse_days(tokens[0])
+            if days is None:
+                return None
+            if not days:
+                continue  # holiday-only rule
+            tokens = tokens[1:]
+        times = parse_times(''.join(tokens)) if tokens else [(0, 24 * 60)]
+        if times is None:
+            return None
+
+        # later rules replace the hours of the days they mention (but not the previous night's spill)
+        has_rule = True
+        own[days] = False
+        spill[days] = False
+        if closed:
+            continue
+        for day in days:
+            for start, end in times:
+                day_hours = np.arange(start // 60, (end - 1) // 60 + 1)
+                own[day, day_hours[day_hours < 24]] = True
+                spill[day, day_hours[day_hours >= 24] - 24] = True
+
+    if not has_rule:
+        return None
+    hours = own | np.roll(spill, 1, axis=0)
+    bits = hours * (1 << np.arange(24))
+    return bits.sum(axis=1).astype(int).tolist()
+
+def hour_of_week(open_at):
+    """
+    Convert a datetime (or an hour-of-week index) to an hour-of-week index (0 = Monday 00:00).
+    """
+    if isinstance(open_at, (int, np.integer)):
+        return int(open_at) % (7 * 24)
+    return open_at.weekday() * 24 + open_at.hour
+
+def is_open_at(amenities, open_at):
+    """
+    Vectorized check of which amenities are open at a given time.
+
+    Arguments:
+    - amenities: DataFrame with the HOURS_COLUMNS bitmask columns.
+    - open_at: A datetime or an hour-of-week index (0 = Monday 00:00, 167 = Sunday 23:00).
+
+    Returns:
+    - A boolean numpy array, True for amenities that are open (or have unknown hours).
+    """
+    day, hour = divmod(hour_of_week(open_at), 24)
+    mask = amenities[HOURS_COLUMNS[day]].fillna(ALWAYS_OPEN).to_numpy(dtype=np.uint32)
+    return ((mask >> np.uint32(hour)) & 1).astype(bool)
@@ -0,0 +1,94 @@
+import threading
+import numpy as np
+from opening_hours import hour_of_week
+from hotel_ranking import score_hotels
+
+# process-wide ranking results shared by every session, keyed by ranking_key
+# each entry only holds small read-only arrays aligned to the rows of the shared hotel table;
+# cleared by clear_rankings when amenities change
+_rankings = {}
+_lock = threading.Lock()
+
+# bumped by clear_rankings, so that a ranking scored before a clear is not stored after it
+_generation = 0
+
+# oldest results are dropped beyond this many entries (a few KB each); a dropped key is simply recomputed
+MAX_RANKINGS = 4096
+
+def ranking_key(ranking, buffer_m=350, open_at=None):
+    """
+    Build the hashable key identifying a ranking: the weight vector, the buffer radius and the opening time.
+
+    The key holds everything needed to recompute the ranking, so sessions can keep only the key.
+    """
+    open_at = hour_of_week(open_at) if open_at is not None else None
+    return (tuple(ranking.items()), buffer_m, open_at)
+
+def get_ranking(hotels, key):
+    """
+    Return the shared ranking result for a key, scoring the hotels only if no session has asked for it yet.
+
+    Arguments:
+    - hotels: The shared hotels GeoDataFrame (the same table for every call).
+    - key: A key from ranking_key.
+
+    Returns:
+    - A dictionary of read-only arrays aligned to the rows of hotels: 'total_score' (0–100),
+      'scores' (weighted score per ranked category, shape (n_hotels, n_categories)) and
+      'order' (hotel positions sorted by descending total score).
+    """
+    with _lock:
+        if key in _rankings:
+            return _rankings[key]
+        generation = _generation
+
+    # score outside the lock; two sessions racing on a new key compute the same arrays
+    ranking, buffer_m, open_at = dict(key[0]), key[1], key[2]
+    results = score_hotels(hotels, ranking, buffer_m=buffer_m, open_at=open_at)
+    total_score = results['total_score'].to_numpy(dtype=np.float64)
+    entry = {
+        'total_score': total_score,
+        'scores': results[[f'score_{category.replace(" ", "_")}' for category in ranking]].to_numpy(dtype=np.float32),
+        'order': np.argsort(-total_score, kind='stable').astype(np.int32),
+    }
+    for values in entry.values():
+        values.setflags(write=False)
+
+    with _lock:
+        if generation != _generation:
+            return entry  # the rankings were cleared while scoring (e.g. amenity diff); do not store a stale result
+        entry = _rankings.setdefault(key, entry)
+        while len(_rankings) > MAX_RANKINGS:
+            del _rankings[next(iter(_rankings))]
+    return entry
+
+def ranked_hotels(hotels, key, top=None):
+    """
+    Build the ranked hotels table for display from the shared ranking result.
+
+    The table is a temporary view for the current rerun; it should not be stored in the session.
+
+    Arguments:
+    - hotels: The shared hotels GeoDataFrame.
+    - key: A key from ranking_key.
+    - top: Optional number of best hotels to keep.
+
+    Returns:
+    - GeoDataFrame of hotels sorted by descending 'total_score', with the 'score_<category>' columns.
+    """
+    entry = get_ranking(hotels, key)
+    order = entry['order'][:top]
+    table = hotels.iloc[order].reset_index(drop=True)
+    table['total_score'] = entry['total_score'][order]
+    for i, (category, _) in enumerate(key[0]):
+        table[f'score_{category.replace(" ", "_")}'] = entry['scores'][order, i]
+    return table
+
+def clear_rankings():
+    """
+    Drop all stored rankings (e.g. after the amenity data changed); they are recomputed on demand.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        _rankings.clear()
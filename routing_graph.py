@@ -0,0 +1,100 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+def build_routing_graph(G):
+    """
+    Convert an osmnx/networkx walking graph into compact compressed sparse row (CSR) arrays.
+
+    Nodes are renumbered 0..n-1 in the order of their sorted OSM ids; parallel edges are
+    collapsed to the shortest one, as networkx does for shortest paths on a MultiDiGraph.
+
+    Arguments:
+    - G: The osmnx MultiDiGraph (nodes with 'x'/'y', edges with 'length').
+
+    Returns:
+    - A dictionary with 'node_ids' (OSM id of each node, for mapping back), 'x'/'y' (lon/lat),
+      and the CSR arrays 'indptr', 'indices' (edge targets) and 'lengths' (float32 meters).
+    """
+    node_ids = np.array(sorted(G.nodes), dtype=np.int64)
+    x = np.array([G.nodes[node]['x'] for node in node_ids], dtype=np.float64)
+    y = np.array([G.nodes[node]['y'] for node in node_ids], dtype=np.float64)
+
+    edges = np.array([(u, v, length) for u, v, length in G.edges(data='length')], dtype=np.float64).reshape(-1, 3)
+    sources = np.searchsorted(node_ids, edges[:, 0].astype(np.int64))
+    targets = np.searchsorted(node_ids, edges[:, 1].astype(np.int64))
+    lengths = edges[:, 2]
+
+    # keep the shortest of parallel edges: sort by (source, target, length) and drop repeats
+    order = np.lexsort((lengths, targets, sources))
+    sources, targets, lengths = sources[order], targets[order], lengths[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    sources, targets, lengths = sources[first], targets[first], lengths[first]
+
+    return {
+        'node_ids': node_ids,
+        'x': x,
+        'y': y,
+        'indptr': np.searchsorted(sources, np.arange(len(node_ids) + 1)).astype(np.int32),
+        'indices': targets.astype(np.int32),
+        'lengths': lengths.astype(np.float32),
+    }
+
+def as_csr(graph):
+    """
+    Wrap the CSR arrays of a routing graph in a scipy sparse matrix (no copy).
+    """
+    n = len(graph['node_ids'])
+    return csr_matrix((graph['lengths'], graph['indices'], graph['indptr']), shape=(n, n), copy=False)
+
+def nearest_nodes(graph, lons, lats):
+    """
+    Snap locations to the nearest graph node by great-circle distance.
+
+    Returns:
+    - An array with the node index (not the OSM id) of each location.
+    """
+    node_lon, node_lat = np.radians(graph['x']), np.radians(graph['y'])
+    nearest = []
+    for lon, lat in zip(np.radians(lons), np.radians(lats)):
+        # haversine formula (the constant earth radius does not change the argmin)
+        a = np.sin((node_lat - lat) / 2) ** 2 + np.cos(lat) * np.cos(node_lat) * np.sin((node_lon - lon) / 2) ** 2
+        nearest.append(int(np.argmin(a)))
+    return np.array(nearest, dtype=np.int64)
+
+def shortest_paths(graph, sources):
+    """
+    Run Dijkstra from many source nodes at once with scipy's compiled csgraph routines.
+
+    Arguments:
+    - graph: Routing graph from build_routing_graph.
+    - sources: Node indices to search from.
+
+    Returns:
+    - distances: Array of shape (len(sources), n_nodes) with path lengths in meters (inf if unreachable).
+    - predecessors: Array of the same shape with the previous node on each shortest path (-9999 for none).
+    """
+    distances, predecessors = dijkstra(as_csr(graph), directed=True, indices=sources, return_predecessors=True)
+    return distances, predecessors.astype(np.int32)
+
+def path_nodes(predecessors, source, target):
+    """
+    Rebuild the node path from source to target from a row of shortest_paths predecessors.
+
+    Returns:
+    - A list of node indices from source to target (both included).
+    """
+    path = [target]
+    while path[-1] != source:
+        previous = predecessors[path[-1]]
+        if previous < 0:
+            raise ValueError(f"No walking path between nodes {source} and {target}")
+        path.append(previous)
+    return path[::-1]
+
+def node_coords(graph, nodes):
+    """
+    Convert node indices to (lat, lon) coordinate pairs for mapping.
+    """
+    return [(graph['y'][node], graph['x'][node]) for node in nodes]
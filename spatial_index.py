@@ -0,0 +1,193 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pyproj import Transformer
+
+# EPSG:4326 (lon, lat) -> EPSG:26910 (UTM zone 10N, meters), the projected CRS used throughout for distances
+_to_utm = Transformer.from_crs('EPSG:4326', 'EPSG:26910', always_xy=True)
+
+def to_projected_xy(lon, lat):
+    """
+    Project longitude/latitude arrays to EPSG:26910 coordinates in meters.
+
+    Returns:
+    - An array of shape (n, 2) with the projected (x, y) coordinates.
+    """
+    x, y = _to_utm.transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+    return np.column_stack([x, y]).reshape(-1, 2)
+
+def build_grid_index(xy, cell_size):
+    """
+    Build a uniform grid index over projected points, stored as flat numpy arrays.
+
+    Points are sorted by grid cell so that the points of cell c are order[cell_start[c]:cell_start[c + 1]].
+    Plain arrays (rather than a tree of Python objects) keep the index cheap to build and
+    shareable across processes without pickling.
+
+    Arguments:
+    - xy: Array of shape (n, 2) with projected coordinates in meters.
+    - cell_size: Width of a grid cell in meters.
+
+    Returns:
+    - A dictionary with the grid 'origin', 'shape' (columns, rows), 'cell_size', 'order' and 'cell_start'.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    origin = xy.min(axis=0) if len(xy) else np.zeros(2)
+    cells = np.floor((xy - origin) / cell_size).astype(np.int64)
+    shape = cells.max(axis=0) + 1 if len(xy) else np.ones(2, dtype=np.int64)
+
+    cell_ids = cells[:, 1] * shape[0] + cells[:, 0]
+    order = np.argsort(cell_ids, kind='stable')
+    cell_start = np.searchsorted(cell_ids[order], np.arange(shape[0] * shape[1] + 1))
+    return {
+        'origin': origin,
+        'shape': shape,
+        'cell_size': float(cell_size),
+        'order': order,
+        'cell_start': cell_start,
+    }
+
+def query_radius(index, xy, points, radius):
+    """
+    Find all indexed points within a radius of each query point.
+
+    Arguments:
+    - index: Grid index from build_grid_index.
+    - xy: The (n, 2) coordinates the index was built from.
+    - points: Array of shape (m, 2) with projected query coordinates.
+    - radius: Search radius in meters.
+
+    Returns:
+    - query_idx: Index into points for each match.
+    - point_idx: Index into xy for each match.
+    - distances: Distance in meters for each match.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    width, height = index['shape']
+    cells = np.floor((points - index['origin']) / index['cell_size']).astype(np.int64)
+    reach = int(np.ceil(radius / index['cell_size']))
+    query_ids = np.arange(len(points))
+
+    query_parts, point_parts, distance_parts = [], [], []
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            # the neighbouring cell of every query point, skipping cells outside the grid
+            cx, cy = cells[:, 0] + dx, cells[:, 1] + dy
+            inside = (cx >= 0) & (cx < width) & (cy >= 0) & (cy < height)
+            cell = cy[inside] * width + cx[inside]
+            start = index['cell_start'][cell]
+            lengths = index['cell_start'][cell + 1] - start
+            if lengths.sum() == 0:
+                continue
+
+            # expand each (query, cell) pair into one row per candidate point
+            query = np.repeat(query_ids[inside], lengths)
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            candidate = index['order'][np.repeat(start, lengths) + offsets]
+
+            distance = np.hypot(xy[candidate, 0] - points[query, 0], xy[candidate, 1] - points[query, 1])
+            hit = distance <= radius
+            query_parts.append(query[hit])
+            point_parts.append(candidate[hit])
+            distance_parts.append(distance[hit])
+
+    if not query_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(query_parts), np.concatenate(point_parts), np.concatenate(distance_parts)
+
+def count_within(index, xy, codes, n_codes, points, radius):
+    """
+    Count the indexed points within a radius of each query point, grouped by an integer code.
+
+    Arguments:
+    - index: Grid index from build_grid_index.
+    - xy: The (n, 2) coordinates the index was built from.
+    - codes: Integer code (e.g. category) of each indexed point, in [0, n_codes).
+    - n_codes: Number of distinct codes.
+    - points: Array of shape (m, 2) with projected query coordinates.
+    - radius: Search radius in meters.
+
+    Returns:
+    - An integer array of shape (m, n_codes) with the counts.
+    """
+    query, candidate, _ = query_radius(index, xy, points, radius)
+    counts = np.bincount(query * n_codes + codes[candidate], minlength=len(points) * n_codes)
+    return counts.reshape(len(points), n_codes)
+
+# === Parallel counting with shared memory ===
+# arrays attached by each worker process (name -> numpy array)
+_shared = {}
+_shared_blocks = []
+
+def share_arrays(arrays):
+    """
+    Copy numpy arrays into shared memory blocks.
+
+    Returns:
+    - blocks: The SharedMemory objects (the caller must close and unlink them).
+    - specs: Picklable (name, block name, shape, dtype) tuples for attach_arrays.
+    """
+    blocks, specs = [], []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs.append((name, block.name, array.shape, array.dtype.str))
+    return blocks, specs
+
+def attach_arrays(specs):
+    """
+    Worker initializer: map the shared memory blocks described by specs to numpy arrays (no copies).
+    """
+    for name, block_name, shape, dtype in specs:
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared_blocks.append(block)  # keep the mapping alive for the lifetime of the worker
+        _shared[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+def _count_chunk(args):
+    points, n_codes, radius, cell_size = args
+    index = {
+        'origin': _shared['origin'],
+        'shape': _shared['shape'],
+        'cell_size': cell_size,
+        'order': _shared['order'],
+        'cell_start': _shared['cell_start'],
+    }
+    return count_within(index, _shared['xy'], _shared['codes'], n_codes, points, radius)
+
+def parallel_count_within(index, xy, codes, n_codes, points, radius, workers=None, chunk_size=2000):
+    """
+    Same as count_within, but splits the query points into chunks across a process pool.
+
+    The indexed coordinates, codes and grid arrays are placed in shared memory once and mapped
+    by every worker, so only the query chunks and the resulting counts are pickled.
+
+    Arguments:
+    - workers: Number of worker processes (default: number of CPUs).
+    - chunk_size: Number of query points per task.
+
+    Returns:
+    - An integer array of shape (m, n_codes) with the counts, in the order of points.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    chunks = [points[i:i + chunk_size] for i in range(0, len(points), chunk_size)]
+    if not chunks:
+        return np.zeros((0, n_codes), dtype=np.int64)
+
+    blocks, specs = share_arrays({
+        'xy': xy,
+        'codes': codes,
+        'origin': index['origin'],
+        'shape': index['shape'],
+        'order': index['order'],
+        'cell_start': index['cell_start'],
+    })
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_arrays, initargs=(specs,)) as executor:
+            tasks = [(chunk, n_codes, radius, index['cell_size']) for chunk in chunks]
+            return np.vstack(list(executor.map(_count_chunk, tasks)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
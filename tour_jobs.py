@@ -0,0 +1,60 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from generate_tour import prepare_tour_graph, generate_tsp_route, generate_nn_route
+
+# one process-wide pool shared by all sessions, so tours never run on the Streamlit script thread
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='tour')
+
+# tour algorithms computed for each job, in display order
+TOUR_ALGORITHMS = {
+    'tsp': generate_tsp_route,
+    'nn': generate_nn_route,
+}
+
+def run_algorithm(algorithm, selected_hotel, attractions, graph, cancelled):
+    # wait for the shared snapped graph, then compute the route
+    return algorithm(selected_hotel, attractions, tour_graph=graph.result(), cancelled=cancelled)
+
+def submit_tour(selected_hotel, attractions):
+    """
+    Start computing the walking tours of every algorithm in the background.
+
+    The walking network is downloaded and snapped once, then the algorithms run concurrently on it.
+    The graph task is queued before the route tasks that wait for it, so a waiting route task never
+    holds a worker that the graph task still needs.
+
+    Arguments:
+    - selected_hotel: A row from the hotels GeoDataFrame for the selected hotel.
+    - attractions: A pandas DataFrame of attractions sorted by distance from the hotel.
+
+    Returns:
+    - A job dictionary with the 'hotel' name, the 'cancelled' event, the 'graph' future (None once
+      every route is done) and 'routes', a dictionary of route futures per algorithm (see TOUR_ALGORITHMS).
+    """
+    cancelled = threading.Event()
+    graph = _executor.submit(prepare_tour_graph, selected_hotel, attractions)
+    routes = {
+        name: _executor.submit(run_algorithm, algorithm, selected_hotel, attractions, graph, cancelled)
+        for name, algorithm in TOUR_ALGORITHMS.items()
+    }
+    job = {'hotel': selected_hotel['name'], 'cancelled': cancelled, 'graph': graph, 'routes': routes}
+
+    def release_graph(_):
+        # the snapped graph (with its n_stops x n_nodes predecessors) is only needed by the route tasks;
+        # drop it once they are all done so a job kept in the session only holds the routes
+        if all(route.done() for route in routes.values()):
+            job['graph'] = None
+
+    for route in routes.values():
+        route.add_done_callback(release_graph)
+    return job
+
+def cancel_tour(job):
+    """
+    Cancel a tour job: queued tasks are dropped and running algorithms stop at their next check.
+    """
+    job['cancelled'].set()
+    graph = job['graph']
+    for future in [graph, *job['routes'].values()]:
+        if future is not None:
+            future.cancel()
@@ -1,9 +1,7 @@
 import pandas as pd
+from opening_hours import parse_opening_hours, HOURS_COLUMNS
 
-# load the amenities data: amenities-vancouver.json.gz
-df = pd.read_json('data/amenities-vancouver.json.gz', compression='gzip', lines=True)
-
-# filter out the neccessary amenities columns
+# amenity categories (the 'others' category is not ranked or clustered)
 amenity_categories = {
   "food & drink": [
     'cafe', 'fast_food', 'bbq', 'restaurant', 'pub', 'bar', 'food_court', 'ice_cream', 'bistro', 'juice_bar', 'internet_cafe', 'disused:restaurant', 'water_point', 'biergarten'
@@ -32,8 +30,39 @@ category_map = pd.Series({
   for amenity in amenities
 })
 
-df['category'] = df['amenity'].map(category_map).fillna('others')
-df = df.dropna(subset=['lon', 'lat']) # drop rows with missing lon/lat
- 
-# create a csv file from the dataframe
-df.to_csv('data/vancouver_amenities.csv', index=False)
\ No newline at end of file
+# columns identifying a stored amenity (the OSM extract carries no element ids)
+KEY_COLUMNS = ['lat', 'lon', 'amenity', 'name']
+
+def match_amenities(df, rows):
+  """
+  Return a boolean array marking the rows of df that match one of rows on KEY_COLUMNS.
+  """
+  # align the key dtypes (e.g. an all-NaN float 'name' column or categorical codes) before merging
+  dtypes = {'lat': float, 'lon': float, 'amenity': object, 'name': object}
+  keys = df[KEY_COLUMNS].astype(dtypes)
+  merged = keys.merge(rows[KEY_COLUMNS].astype(dtypes).drop_duplicates(), how='left', indicator=True)
+  return (merged['_merge'] == 'both').to_numpy()
+
+def prepare_amenities(df):
+  """
+  Turn raw OSM amenity rows (lat, lon, timestamp, amenity, name, tags) into the stored amenity format.
+
+  Also used by amenity_updates.py to prepare amenities added by a diff.
+  """
+  df = df.copy()
+  df['category'] = df['amenity'].map(category_map).fillna('others')
+  df = df.dropna(subset=['lon', 'lat']) # drop rows with missing lon/lat
+
+  # parse the opening_hours tag into one 24-bit mask per weekday (left empty when unknown)
+  hours = df['tags'].map(lambda tags: parse_opening_hours(tags.get('opening_hours')))
+  hours = hours.map(lambda mask: mask if mask is not None else [None] * 7)
+  df[HOURS_COLUMNS] = pd.DataFrame(hours.tolist(), columns=HOURS_COLUMNS, index=df.index).astype('Int64')
+  return df
+
+if __name__ == '__main__':
+  # load the amenities data: amenities-vancouver.json.gz
+  df = pd.read_json('data/amenities-vancouver.json.gz', compression='gzip', lines=True)
+  df = prepare_amenities(df)
+
+  # create a csv file from the dataframe
+  df.to_csv('data/vancouver_amenities.csv', index=False)
\ No newline at end of file